@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for XText.
+
+The benchmarks draw into a cairo image surface, so no window is shown.  Gtk
+still needs a display to create widgets, on a server use e.g.
+
+    xvfb-run python3 benchmarks.py --output results.json
+
+The results are written as JSON.  With --baseline, they are compared with the
+results of an earlier run and the script exits with status 1 if a  metric  is
+worse than the baseline by more than the threshold.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import itertools
+import argparse
+import platform
+import statistics
+
+import cairo
+from gi.repository import Gdk
+
+import xtext
+from xtext import XText, FormatType, Color, ColorCode
+
+
+WIDTH = 800
+HEIGHT = 600
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    """
+    Register a benchmark function.
+
+    The function gets the scale (1.0 for a full run) and returns a dict that
+    maps metric names to (value, unit, better) tuples, where better is "lower"
+    or "higher".
+    """
+    BENCHMARKS.append(func)
+    return func
+
+
+def timeit(func, repeat=5):
+    """
+    Call func repeat times and return the median time in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def words(rng, count):
+    return " ".join("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(1, 10)))
+                    for _ in range(count))
+
+
+def plain_lines(count, seed=0):
+    rng = random.Random(seed)
+    return ["%d %s" % (i, words(rng, 20)) for i in range(count)]
+
+
+def formatted_lines(count, seed=0):
+    rng = random.Random(seed)
+    codes = [FormatType.BOLD, FormatType.UNDERLINE, FormatType.RESET, Color(ColorCode.RED),
+             Color(ColorCode.BLUE, ColorCode.YELLOW), Color()]
+    return ["%d %s" % (i, "".join(rng.choice(codes) + words(rng, 2) + " " for _ in range(10)))
+            for i in range(count)]
+
+
+def unbreakable_lines(count, seed=0):
+    rng = random.Random(seed)
+    return ["%d%s" % (i, "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(2000)))
+            for i in range(count)]
+
+
+def create_xtext(lines=()):
+    """
+    Create an XText that is allocated to WIDTH x HEIGHT with the given lines.
+    """
+    widget = XText()
+    widget.get_preferred_width()
+    widget.get_preferred_height()
+    rect = Gdk.Rectangle()
+    rect.x = rect.y = 0
+    rect.width = WIDTH
+    rect.height = HEIGHT
+    widget.size_allocate(rect)
+    widget.buffer = list(lines)
+    widget.redraw()
+    return widget
+
+
+def image_context():
+    surface = cairo.ImageSurface(cairo.FORMAT_RGB24, WIDTH, HEIGHT)
+    return cairo.Context(surface)
+
+
+@benchmark
+def break_line(scale):
+    widget = create_xtext()
+    results = {}
+    for name, lines in [("plain", plain_lines(int(2000 * scale))),
+                        ("formatted", formatted_lines(int(2000 * scale))),
+                        ("unbreakable", unbreakable_lines(int(100 * scale) or 1))]:
+        xtext.tokenize.cache_clear()
+        start = time.perf_counter()
+        for line in lines:
+            for _ in widget.break_line(line, WIDTH):
+                pass
+        duration = time.perf_counter() - start
+        results["break_line_%s" % name] = (len(lines) / duration, "lines/s", "higher")
+    return results
+
+
+@benchmark
+def draw(scale):
+    widget = create_xtext(formatted_lines(int(1000 * scale) or 1))
+    cr = image_context()
+
+    def cold():
+        widget.frame = widget.back_frame = None
+        widget.clear_subline_cache()
+        widget.do_draw(cr)
+
+    def scroll():
+        widget.start_subline = (widget.start_subline + 1) % max(1, len(widget.sublines) - HEIGHT // widget.fontheight)
+        widget.do_draw(cr)
+
+    rows = HEIGHT // widget.fontheight + 1
+    chars = sum(len(xtext.strip_attributes(text)) for attrs, text in widget.sublines[:rows])
+    cold_time = timeit(cold)
+    widget.do_draw(cr)
+    return {
+        "do_draw_cold": (cold_time * 1000, "ms", "lower"),
+        "do_draw_cold_chars": (chars / cold_time, "chars/s", "higher"),
+        "do_draw_warm": (timeit(lambda: widget.do_draw(cr)) * 1000, "ms", "lower"),
+        "do_draw_scroll": (timeit(scroll, 20) * 1000, "ms", "lower"),
+    }
+
+
+@benchmark
+def selection_drag(scale):
+    widget = create_xtext(formatted_lines(int(1000 * scale) or 1))
+    widget.render_frame(WIDTH, HEIGHT)
+    rows = HEIGHT // widget.fontheight
+    areas = []
+    widget.queue_draw_area = lambda x, y, width, height: areas.append((y, y + height))
+    widget.selection_start = 0, 0
+    row = itertools.cycle(range(rows))
+
+    def drag():
+        # move the selection end by one row and redraw the damaged rows
+        widget.set_selection_end((next(row), 5))
+        for clip in areas:
+            widget.render_frame(WIDTH, HEIGHT, clip)
+        del areas[:]
+    return {"selection_drag": (timeit(drag, 20) * 1000, "ms", "lower")}
+
+
+@benchmark
+def find_char_at_pos(scale):
+    widget = create_xtext(formatted_lines(int(1000 * scale) or 1))
+    rng = random.Random(0)
+    points = [(rng.uniform(0, WIDTH), rng.uniform(0, HEIGHT)) for _ in range(int(1000 * scale) or 1)]
+
+    def run():
+        for x, y in points:
+            widget.find_char_at_pos(x, y)
+    return {"find_char_at_pos": (timeit(run) / len(points) * 1e6, "us", "lower")}
+
+
+@benchmark
+def get_selection(scale):
+    count = int(5000 * scale) or 1
+    widget = create_xtext(formatted_lines(count))
+    widget.selection_start = 0, 3
+    widget.selection_end = len(widget.sublines) - 1, 5
+    return {
+        "get_selection_%d_lines" % count: (timeit(widget.get_selection) * 1000, "ms", "lower"),
+        "copy_selection_%d_lines" % count: (timeit(widget.copy_selection) * 1000, "ms", "lower"),
+    }
+
+
+@benchmark
+def size_allocate(scale):
+    count = int(20000 * scale) or 1
+    widget = create_xtext(plain_lines(count))
+    widget.background_rewrap_lines = None  # time the rewrap, not starting a thread
+    widget.selection_start = 10, 3
+    widget.selection_end = len(widget.sublines) - 10, 5
+
+    class Rect:
+        width = WIDTH
+
+    def rewrap():
+        Rect.width = WIDTH - 100 if Rect.width == WIDTH else WIDTH
+        widget.size_allocate_cb(Rect)
+
+    results = {"size_allocate_cb_%d_lines" % count: (timeit(rewrap, 3) * 1000, "ms", "lower")}
+    if widget.batch_wrap:
+        # the pure Python wrapping for comparison
+        widget.batch_wrap = False
+        results["size_allocate_cb_%d_lines_python" % count] = (timeit(rewrap, 3) * 1000, "ms", "lower")
+        widget.batch_wrap = True
+    widget.lazy_wrap = True
+    results["size_allocate_cb_%d_lines_lazy" % count] = (timeit(rewrap, 3) * 1000, "ms", "lower")
+    return results
+
+
+@benchmark
+def search(scale):
+    count = int(20000 * scale) or 1
+    widget = create_xtext(plain_lines(count))
+    start = time.perf_counter()
+    widget.search("xyz")  # builds the index
+    index_time = time.perf_counter() - start
+    return {
+        "search_index_%d_lines" % count: (index_time * 1000, "ms", "lower"),
+        "search_%d_lines" % count: (timeit(lambda: widget.search("hello")) * 1000, "ms", "lower"),
+        "search_short_%d_lines" % count: (timeit(lambda: widget.search("ab")) * 1000, "ms", "lower"),
+    }
+
+
+@benchmark
+def render_pages(scale):
+    renderer = xtext.Renderer()
+    lines = formatted_lines(50)
+    count = int(20 * scale) or 1
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "page-%d.png")
+        duration = timeit(lambda: [renderer.render_pages(lines, WIDTH, HEIGHT, path) for _ in range(count)], 3)
+    return {"render_pages_snapshots": (count / duration * 60, "snapshots/min", "higher")}
+
+
+def run(scale, names=None):
+    metrics = {}
+    for func in BENCHMARKS:
+        if names and func.__name__ not in names:
+            continue
+        for name, (value, unit, better) in func(scale).items():
+            metrics[name] = {"value": value, "unit": unit, "better": better}
+            print("%-40s %14.2f %s" % (name, value, unit), file=sys.stderr)
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scale": scale,
+        "metrics": metrics,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare the results with a baseline and return the names of the metrics
+    that are worse by more than threshold (0.1 means 10 %).
+    """
+    regressions = []
+    for name, metric in sorted(results["metrics"].items()):
+        old = baseline.get("metrics", {}).get(name)
+        if old is None or not old["value"] or not metric["value"]:
+            continue
+        if metric["better"] == "lower":
+            change = metric["value"] / old["value"] - 1
+        else:
+            change = old["value"] / metric["value"] - 1
+        metric["baseline"] = old["value"]
+        metric["change"] = change
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        print("%-40s %+8.1f %%%s" % (name, change * 100, "  REGRESSION" if regressed else ""), file=sys.stderr)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help="benchmarks to run: %s (default: all)" % ", ".join(func.__name__ for func in BENCHMARKS))
+    parser.add_argument("--output", "-o", help="write the results to this JSON file (default: stdout)")
+    parser.add_argument("--baseline", "-b", help="compare with the results in this JSON file")
+    parser.add_argument("--threshold", "-t", type=float, default=0.1,
+                        help="allowed slowdown compared with the baseline (default: 0.1 = 10 %%)")
+    parser.add_argument("--scale", "-s", type=float, default=1.0,
+                        help="scale the amount of data, e.g. 0.1 for a quick run")
+    args = parser.parse_args(argv)
+    unknown = set(args.names) - {func.__name__ for func in BENCHMARKS}
+    if unknown:
+        parser.error("unknown benchmarks: %s" % ", ".join(sorted(unknown)))
+
+    results = run(args.scale, args.names)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        results["regressions"] = regressions
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
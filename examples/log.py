@@ -14,8 +14,7 @@ class XLogger(XText):
         super().__init__(*args, **kwargs)
 
     def add_line(self, timestamp, message):
-        self.buffer.append("15[%s] %s" % (time.strftime("%T", time.localtime(timestamp)), message))
-        self.redraw()
+        self.append_line("15[%s] %s" % (time.strftime("%T", time.localtime(timestamp)), message))
 
 
 lines = [
@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+
+import sys
+sys.path.append("..")
+
+from xtext import Renderer
+
+
+# render the last lines of a log into PNG or SVG pages without a display,
+# e.g. snapshot.py /var/log/syslog "syslog-%d.png"
+path = sys.argv[1] if len(sys.argv) > 1 else "/var/log/syslog"
+output = sys.argv[2] if len(sys.argv) > 2 else "snapshot-%d.png"
+
+with open(path, errors="replace") as f:
+    lines = f.read().splitlines()[-200:]
+
+renderer = Renderer()
+for page in renderer.render_pages(lines, 800, 600, output):
+    print(page)
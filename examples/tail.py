@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+import sys
+sys.path.append("..")
+
+import asyncio
+from gi.events import GLibEventLoopPolicy
+from gi.repository import Gtk
+from xtext import ScrollableXText, LineSource
+
+
+async def tail(xtext, path):
+    process = await asyncio.create_subprocess_exec("tail", "-n", "1000", "-f", path,
+                                                   stdout=asyncio.subprocess.PIPE)
+    await LineSource(xtext, process.stdout).run()
+
+
+# run asyncio in the GLib main loop
+asyncio.set_event_loop_policy(GLibEventLoopPolicy())
+loop = asyncio.new_event_loop()
+
+xtext = ScrollableXText()
+xtext.xtext.set_size_request(600, 400)
+
+window = Gtk.Window(title="GtkXText")
+window.connect("destroy", lambda window: loop.stop())
+window.add(xtext)
+window.show_all()
+
+task = loop.create_task(tail(xtext.xtext, sys.argv[1] if len(sys.argv) > 1 else "/var/log/syslog"))
+loop.run_forever()
@@ -1,6 +1,14 @@
+import os
+import math
+import asyncio
+import tempfile
 import unittest
+import threading
+import cairo
 import xtext
 
+from gi.repository import Gdk, GLib
+
 
 class HelperTest(unittest.TestCase):
 
@@ -17,6 +25,41 @@ class HelperTest(unittest.TestCase):
         self.assertEqual(sa("\x0304Hello\x03,02 World\x031,1"), "Hello World")
         self.assertEqual(sa("\x0304\x03,02\x031,1"), "")
 
+    def test_tokenize(self):
+        tk = xtext.tokenize
+        S = xtext.Style
+
+        self.assertEqual(tk(""), ())
+        self.assertEqual(tk("Hello"), ((0, 5, xtext.PLAIN),))
+        self.assertEqual(tk("\x02Hello \x0FWorld\x1F"), (
+            (1, 7, S(True, None, None, False)),
+            (8, 13, S(False, None, None, False)),
+        ))
+        self.assertEqual(tk("\x034,12a\x03,5b\x03c"), (
+            (5, 6, S(False, 4, 12, False)),
+            (9, 10, S(False, None, 5, False)),
+            (11, 12, S(False, None, None, False)),
+        ))
+        self.assertEqual(tk("a\x03,"), ((0, 1, xtext.PLAIN), (2, 3, xtext.PLAIN)))
+        self.assertEqual(tk("a\x02b", S(True, 3, None, False)), (
+            (0, 1, S(True, 3, None, False)),
+            (2, 3, S(False, 3, None, False)),
+        ))
+
+    def test_pack_runs(self):
+        S = xtext.Style
+        plain = xtext.PLAIN.pack()
+
+        self.assertEqual([0], list(xtext.pack_runs("")))
+        self.assertEqual([0, 0, 5, plain], list(xtext.pack_runs("Hello")))
+        self.assertEqual([0, 1, 6, S(True, None, None, False).pack(), 8, 5, plain],
+                         list(xtext.pack_runs("\x02Hello \x0FWorld\x1F")))
+        self.assertEqual([4, 5, 2, S(True, None, None, False).pack()], list(xtext.pack_runs("\x02b\x02\t\x02aa", 4)))
+        for line in ["\x034,12a\x03,5b\x03c", "a\x03,", "\x1f\x02a\x02b\x0399,99c\x0fd"]:
+            table = xtext.pack_runs(line)
+            self.assertEqual(xtext.tokenize(line), tuple((start, start + length, S.unpack(style))
+                                                         for start, length, style in zip(*[iter(table[1:])] * 3)))
+
     def test_format_type(self):
         FT = xtext.FormatType
 
@@ -29,6 +72,21 @@ class HelperTest(unittest.TestCase):
         self.assertEqual(FT.BOLD + "hello", "\x02hello")
         self.assertEqual(FT.BOLD + FT.COLOR, "\x02\x03")
 
+    def test_style_pack(self):
+        Style = xtext.Style
+        for style in [xtext.PLAIN, Style(True, 0, None, False), Style(False, None, 99, True), Style(True, 15, 0, True)]:
+            self.assertEqual(style, Style.unpack(style.pack()))
+
+    def test_find_links(self):
+        L = xtext.Link
+        self.assertEqual((L(2, 5, "nick", "bob"), L(11, 36, "url", "https://example.com/a_(b)"),
+                          L(42, 49, "channel", "#python")),
+                         xtext.find_links("<@bob> see https://example.com/a_(b). and #python, ok"))
+        self.assertEqual((L(7, 18, "url", "www.foo.org"), L(25, 30, "channel", "#chan")),
+                         xtext.find_links("visit (www.foo.org) and \x02#chan\x02!"))
+        self.assertEqual((L(0, 5, "nick", "alice"),), xtext.find_links("alice: hi a#b", {"alice"}))
+        self.assertEqual((), xtext.find_links("nothing here"))
+
     def test_color_code(self):
         FT = xtext.FormatType
         CC = xtext.ColorCode
@@ -141,6 +199,151 @@ class SelectionTest(unittest.TestCase):
         self.assertEqual((1, 3, "a"), xtext.find_char_at_pos(3 * c_width + 1, height * 1.5))
         self.assertEqual((2, 0, ""), xtext.find_char_at_pos(3 * c_width + 1, height * 2.5))
 
+    def test_subline_selection(self):
+        xtext = self.xtext
+        self.assertEqual((0, 0), xtext.get_subline_selection(0))
+
+        xtext.selection_start = 3, 2
+        xtext.selection_end = 1, 4
+        self.assertEqual((0, 0), xtext.get_subline_selection(0))
+        self.assertEqual((4, math.inf), xtext.get_subline_selection(1))
+        self.assertEqual((0, math.inf), xtext.get_subline_selection(2))
+        self.assertEqual((0, 2), xtext.get_subline_selection(3))
+        self.assertEqual((0, 0), xtext.get_subline_selection(4))
+
+        xtext.selection_end = 3, 1
+        self.assertEqual((1, 2), xtext.get_subline_selection(3))
+
+    def test_subline_cache(self):
+        xtext = self.xtext
+        attrs = {"bold": True}
+        surface = xtext.get_subline_surface(attrs, "abc", 0, 100)
+        self.assertIs(surface, xtext.get_subline_surface(attrs, "abc", 0, 100))
+        self.assertIs(surface, xtext.get_subline_surface(attrs, "abc", 5, 100))
+        self.assertIsNot(surface, xtext.get_subline_surface({}, "abc", 0, 100))
+        self.assertIsNot(surface, xtext.get_subline_surface(attrs, "abc", 0, 50))
+
+        xtext.selection_start = 0, 1
+        xtext.selection_end = 0, 2
+        self.assertIsNot(surface, xtext.get_subline_surface(attrs, "abc", 0, 100))
+        self.assertIs(surface, xtext.get_subline_surface(attrs, "abc", 5, 100))
+
+        xtext.set_color("background", (0, 0, 0))
+        self.assertIsNot(surface, xtext.get_subline_surface(attrs, "abc", 5, 100))
+
+        # changing the palette or the fonts in place is noticed, too
+        surface = xtext.get_subline_surface(attrs, "abc", 5, 100)
+        xtext.colors["background"] = (1, 1, 1)
+        self.assertIsNot(surface, xtext.get_subline_surface(attrs, "abc", 5, 100))
+        surface = xtext.get_subline_surface(attrs, "abc", 5, 100)
+        xtext.fonts["bold"] = xtext.fonts["normal"]
+        self.assertIsNot(surface, xtext.get_subline_surface(attrs, "abc", 5, 100))
+        surface = xtext.get_subline_surface(attrs, "abc", 5, 100)
+        xtext.colors = dict(xtext.colors)
+        self.assertIsNot(surface, xtext.get_subline_surface(attrs, "abc", 5, 100))
+
+        xtext.subline_cache_size = 1
+        xtext.get_subline_surface(attrs, "def", 5, 100)
+        self.assertEqual(1, len(xtext.subline_cache))
+
+        # the cache is bounded by the size of the surfaces, too
+        xtext.subline_cache_size = 256
+        row_bytes = surface.get_stride() * surface.get_height()
+        xtext.subline_cache_bytes = 3 * row_bytes
+        for text in "ghijk":
+            xtext.get_subline_surface(attrs, text, 5, 100)
+        self.assertEqual(3, len(xtext.subline_cache))
+        self.assertEqual(3 * row_bytes, xtext.subline_cache_used)
+        xtext.set_color("background", (0.0, 0.0, 0.0))
+        self.assertEqual((0, 0), (len(xtext.subline_cache), xtext.subline_cache_used))
+
+    def test_scroll_frame(self):
+        xtext = self.xtext
+        height = xtext.fontheight
+        xtext.sublines = [({}, "line %d" % i) for i in range(20)]
+
+        rendered = []
+        get_subline_surface = xtext.get_subline_surface
+
+        def record(attrs, text, subline_no, width):
+            rendered.append(subline_no)
+            return get_subline_surface(attrs, text, subline_no, width)
+        xtext.get_subline_surface = record
+
+        xtext.render_frame(100, 5 * height)
+        self.assertEqual([0, 1, 2, 3, 4], rendered)
+
+        # scroll down two sublines
+        del rendered[:]
+        xtext.start_subline = 2
+        xtext.render_frame(100, 5 * height)
+        self.assertEqual([5, 6], rendered)
+
+        # change a visible subline and the selection
+        del rendered[:]
+        xtext.sublines[3] = ({}, "changed")
+        xtext.selection_start = 5, 0
+        xtext.selection_end = 5, 2
+        xtext.render_frame(100, 5 * height)
+        self.assertEqual([3, 5], rendered)
+
+        # a new width renders everything
+        del rendered[:]
+        xtext.render_frame(120, 5 * height)
+        self.assertEqual([2, 3, 4, 5, 6], rendered)
+
+    def test_selection_damage(self):
+        xtext = self.xtext
+        height = xtext.fontheight
+        rect = Gdk.Rectangle()
+        rect.x = rect.y = 0
+        rect.width = 100
+        rect.height = 5 * height
+        xtext.size_allocate(rect)
+        self.assertEqual(5, xtext.max_lines)
+        xtext.sublines = [({}, "line %d" % i) for i in range(20)]
+        areas = []
+        xtext.queue_draw_area = lambda x, y, width, h: areas.append((y // height, (y + h) // height))
+
+        xtext.selection_start = 2, 1
+        xtext.set_selection_end((2, 3))
+        self.assertEqual([(2, 3)], areas)
+        del areas[:]
+        xtext.set_selection_end((5, 0))
+        self.assertEqual([(2, 5)], areas)
+        del areas[:]
+        xtext.set_selection_end((4, 2))
+        self.assertEqual([(4, 5)], areas)
+        del areas[:]
+        xtext.set_selection_end((4, 2))
+        xtext.set_selection_end((30, 0))  # only the visible rows
+        self.assertEqual([(4, 5)], areas)
+
+        # only the damaged rows are checked and rendered
+        rendered = []
+        get_subline_surface = xtext.get_subline_surface
+
+        def record(attrs, text, subline_no, width):
+            rendered.append(subline_no)
+            return get_subline_surface(attrs, text, subline_no, width)
+        xtext.get_subline_surface = record
+        xtext.render_frame(100, 5 * height)
+        del rendered[:]
+        xtext.set_selection_end((3, 2))
+        xtext.render_frame(100, 5 * height, (3 * height, 5 * height))
+        self.assertEqual([3, 4], rendered)
+        self.assertEqual(list(range(5)), sorted(xtext.frame_rows))
+
+        # a new press clears the old selection
+        del areas[:]
+
+        class Event:
+            x = 50
+            y = 0.5 * height
+        xtext.do_button_press_event(Event)
+        self.assertEqual((0, None), (xtext.selection_start[0], xtext.selection_end))
+        self.assertEqual([(2, 4)], areas)
+
     def test_selection_full_line(self):
         xtext = self.xtext
 
@@ -241,6 +444,824 @@ class SelectionTest(unittest.TestCase):
         self.assertEqual((2, 3), xtext.selection_end)
         self.assertEqual(line[1:-1], xtext.get_selection())
 
+    def test_copy_selection(self):
+        xtext = self.xtext
+
+        class Rect:
+            width = 1000
+        xtext.buffer = ["\x02aa\x02 bb", "\x034cc", "dd", "ee"]
+        xtext.size_allocate_cb(Rect)
+        xtext.selection_start = 2, 1
+        xtext.selection_end = 0, 2
+        self.assertEqual(((0, 2), (2, 1)), xtext.get_selection_range())
+        self.assertEqual("a bb\ncc\nd", xtext.get_selection())
+        xtext.selection_end = 4, 0
+        self.assertEqual("d\nee", xtext.get_selection())
+
+        # the text is created when it is pasted, from the lines in the buffer then
+        xtext.selection_end = 0, 2
+        xtext.copy_selection()
+        xtext.selection_start = xtext.selection_end = None
+        xtext.scrollback_lines = 4
+        xtext.append_line("ff")
+
+        class SelectionData:
+            def set_text(self, text, length):
+                self.text = text
+        data = SelectionData()
+        xtext.selection_get_cb(data, 0, 0)
+        self.assertEqual("cc\nd", data.text)
+        xtext.selection_clear_cb(None)
+        self.assertEqual("", xtext.get_clipboard_text())
+
+        # the copied lines move with the lines inserted or deleted before them
+        xtext.scrollback_lines = None
+        xtext.selection_start, xtext.selection_end = (1, 0), (2, 1)
+        xtext.copy_selection()
+        self.assertEqual("dd\ne", xtext.get_clipboard_text())
+        xtext.replace_lines(0, 0, ["xx", "yy"])
+        self.assertEqual("dd\ne", xtext.get_clipboard_text())
+        xtext.replace_lines(0, 1, [])
+        self.assertEqual("dd\ne", xtext.get_clipboard_text())
+        xtext.replace_lines(4, 1, ["ff", "gg"])
+        self.assertEqual("dd\ne", xtext.get_clipboard_text())
+        xtext.replace_lines(2, 1, ["d1", "d2"])  # the copied lines were replaced
+        self.assertEqual("", xtext.get_clipboard_text())
+        xtext.copy_selection()
+        xtext.replace_line(3, "dd")  # by the same number of lines
+        self.assertEqual("", xtext.get_clipboard_text())
+        xtext.copy_selection()
+        xtext.buffer = ["aa", "bb"]
+        self.assertEqual("", xtext.get_clipboard_text())
+
+
+class WrapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.xtext = xtext.XText()
+
+        class Rect:
+            pass
+        self.rect = Rect()
+        layout = self.xtext.create_pango_layout("a")
+        layout.set_font_description(self.xtext.fonts["normal"])
+        self.rect.width = 10 * layout.get_pixel_size()[0]
+
+    def test_append_lines(self):
+        xtext = self.xtext
+        lines = ["aaaa aaaa aaaa", "\x02bbbbbbbbbbbbbbbbbbbbbbbb", "cc"]
+
+        xtext.size_allocate_cb(self.rect)
+        self.assertEqual([], xtext.sublines)
+        xtext.append_line(lines[0])
+        xtext.append_lines(lines[1:])
+        self.assertEqual(lines, xtext.buffer)
+        sublines = list(xtext.sublines)
+
+        xtext.redraw()
+        xtext.size_allocate_cb(self.rect)
+        self.assertEqual(sublines, xtext.sublines)
+
+    def test_packed_sublines(self):
+        xtext = self.xtext
+        xtext.buffer = ["aaaa aaaa aaaa", "\x02\x034,12bb"]
+        xtext.size_allocate_cb(self.rect)
+        self.assertEqual([0, 9, 0xfffc, 10, 14, 0xfffc], list(xtext.sublines.lines[0]))
+        self.assertEqual(list(xtext.break_line(xtext.buffer[0], self.rect.width)), xtext.sublines.get_line(0))
+        self.assertEqual([({"bold": False, "fcolor": None, "bcolor": None, "underline": False,
+                            "first_subline": True, "offset": 0}, "\x02\x034,12bb")], xtext.sublines[2:])
+        self.assertEqual((1, 0), xtext.sublines.from_line_pos(0, 10))
+        self.assertEqual((0, 14), xtext.sublines.to_line_pos(1, 4))
+
+    def test_links(self):
+        widget = self.xtext
+        widget.buffer = ["see www.a.org", "\x02#chan\x02 x"]
+        widget.size_allocate_cb(self.rect)
+        self.assertEqual([None, None], widget.line_links)  # found when they are needed
+        self.assertEqual([(xtext.Link(4, 13, "url", "www.a.org"),), (xtext.Link(1, 6, "channel", "#chan"),)],
+                         [widget.get_links(0), widget.get_links(1)])
+        widget.append_line("hi bob")
+        self.assertEqual((), widget.line_links[-1])
+        widget.nicks.add("bob")
+        widget.append_line("hi bob")
+        self.assertEqual((xtext.Link(3, 6, "nick", "bob"),), widget.line_links[-1])
+
+        clicked = []
+        widget.link_handler = lambda line_no, link: clicked.append((line_no, link.target))
+        width = self.rect.width / 10
+
+        class Event:
+            x = width * 5.5  # in the URL in the second subline
+            y = widget.fontheight * 1.5
+        widget.do_motion_notify_event(Event)
+        self.assertEqual((0, 4, 13), widget.hover_link)
+        self.assertEqual((0, 0), widget.get_subline_hover(0))
+        self.assertEqual((0, 9), widget.get_subline_hover(1))
+        widget.do_button_press_event(Event)
+        widget.do_button_release_event(Event)
+        self.assertEqual([(0, "www.a.org")], clicked)
+
+        Event.x = width * 6.5  # after the channel
+        Event.y = widget.fontheight * 2.5
+        widget.do_motion_notify_event(Event)
+        self.assertIsNone(widget.hover_link)
+        self.assertIsNone(widget.find_link_at_pos(Event.x, Event.y))
+        widget.scrollback_lines = 2
+        widget.trim_scrollback()
+        self.assertEqual(2, len(widget.line_links))
+
+    def test_indent(self):
+        widget = self.xtext
+        char_width = self.rect.width // 10
+        widget.indent = True
+        widget.buffer_indent = 5 * char_width
+        widget.buffer = ["\x02bob\x02\taaaa aaaa aaaa aaaa aaaa", "no nick"]
+        rect = Gdk.Rectangle()
+        rect.x = rect.y = 0
+        rect.width = widget.get_message_left() + 20 * char_width
+        rect.height = 10 * widget.fontheight
+        widget.size_allocate(rect)
+
+        # only the message is wrapped, the nick is drawn in front of the first subline
+        self.assertEqual(["aaaa aaaa aaaa aaaa", "aaaa", "no nick"], [text for attrs, text in widget.sublines])
+        self.assertEqual(["\x02bob\x02", "", ""], [widget.get_nick(i) for i in range(3)])
+        nick_width = widget.get_width_table(True).text_width("bob")
+        self.assertEqual(nick_width, widget.get_nick_width("\x02bob\x02"))
+        self.assertEqual((0, 0, ""), widget.find_char_at_pos(char_width, 1))
+        self.assertEqual((1, 1, "a"), widget.find_char_at_pos(widget.get_message_left() + 1.5 * char_width,
+                                                              1.5 * widget.fontheight))
+        widget.selection_start = 0, 0
+        widget.selection_end = 1, 3
+        self.assertEqual("aaaa aaaa aaaa aaaa aaa", widget.get_selection())
+        widget.render_frame(rect.width, rect.height)
+
+        # dragging the separator rewraps only the displayed lines until it is released
+        class Event:
+            x = widget.buffer_indent + 1
+            y = 1
+        widget.do_button_press_event(Event)
+        self.assertTrue(widget.separator_drag)
+        sublines = widget.sublines
+        packed = sublines.lines[1]
+        widget.max_lines = 1
+        Event.x = 10 * char_width
+        widget.do_motion_notify_event(Event)
+        self.assertEqual(10 * char_width, widget.buffer_indent)
+        self.assertIs(sublines, widget.sublines)
+        self.assertEqual(rect.width - widget.get_message_left(), sublines.width)
+        self.assertNotEqual(sublines.width, widget.wrap_width)
+        self.assertEqual(["aaaa aaaa aaaa", "aaaa aaaa", "no nick"], [text for attrs, text in widget.sublines])
+        self.assertIs(packed, sublines.lines[1])  # not displayed
+        self.assertEqual("aaaa aaaa aaaa aaaa aaa", widget.get_selection())
+        widget.max_lines = rect.height / widget.fontheight
+        widget.do_button_release_event(Event)
+        self.assertFalse(widget.separator_drag)
+        self.assertIsNone(widget.sublines.estimate)
+        self.assertEqual(["aaaa aaaa aaaa", "aaaa aaaa", "no nick"], [text for attrs, text in widget.sublines])
+        self.assertEqual("aaaa aaaa aaaa aaaa aaa", widget.get_selection())
+        self.assertEqual({"\x02bob\x02": nick_width}, widget.nick_widths)
+        widget.render_frame(rect.width, rect.height)
+
+        # all lines are wrapped again even if the drag ends at the old width
+        sublines = widget.sublines
+        widget.do_button_press_event(Event)
+        Event.x = 5 * char_width
+        widget.do_motion_notify_event(Event)
+        Event.x = 10 * char_width
+        widget.do_motion_notify_event(Event)
+        self.assertTrue(widget.wrapped_partly)
+        widget.do_button_release_event(Event)
+        self.assertFalse(widget.wrapped_partly)
+        self.assertIsNot(sublines, widget.sublines)
+
+    def test_replace_lines(self):
+        widget = self.xtext
+        widget.buffer = ["aa", "bbbb bbbb bbbb", "cc www.c.org", "dd"]
+        widget.size_allocate_cb(self.rect)
+        widget.search("c")
+        widget.search_next()
+        widget.selection_start = 3, 1
+        widget.selection_end = 5, 1
+        widget.start_subline = 3
+
+        # the same number of sublines before the display, nothing is redrawn
+        drawn = []
+        widget.queue_draw_sublines = lambda first, last: drawn.append((first, last))
+        widget.replace_line(0, "\x02xx")
+        self.assertEqual([], drawn)
+        self.assertEqual(["\x02xx", "bbbb bbbb bbbb", "cc www.c.org", "dd"], list(widget.buffer))
+        self.assertEqual(sum(len(line.encode()) for line in widget.buffer), widget.buffer_bytes)
+
+        # more sublines, the display and the selection are moved
+        widget.replace_line(1, "bbbb bbbb bbbb bbbb bbbb")
+        self.assertEqual(4, widget.start_subline)
+        self.assertEqual([(4, 1), (6, 1)], [widget.selection_start, widget.selection_end])
+        self.assertEqual("c www.c.org\nd", widget.get_selection())
+        widget.insert_lines(3, ["c"])
+        widget.delete_lines(0)
+        self.assertEqual(["bbbb bbbb bbbb bbbb bbbb", "cc www.c.org", "c", "dd"], list(widget.buffer))
+        self.assertEqual((xtext.Link(3, 12, "url", "www.c.org"),), widget.get_links(1))
+        self.assertEqual([xtext.SearchMatch(1, 0, 1), xtext.SearchMatch(1, 1, 2), xtext.SearchMatch(1, 7, 8),
+                          xtext.SearchMatch(2, 0, 1)], widget.get_search_matches())
+        self.assertEqual(0, widget.search_current)
+        self.assertEqual(3, widget.start_subline)
+        self.assertEqual("c www.c.org\nc\nd", widget.get_selection())
+
+        # only the displayed row that changed is redrawn, the selection end in it is moved to its start
+        widget.replace_line(3, "ee")
+        self.assertEqual([(6, 6)], drawn[-1:])
+        self.assertEqual("c www.c.org\nc\n", widget.get_selection())
+        sublines = list(widget.sublines)
+        widget.redraw()
+        widget.size_allocate_cb(self.rect)
+        self.assertEqual(sublines, widget.sublines)
+        self.assertEqual(4, len(widget.search("c")))
+
+    def test_break_after_space(self):
+        table = xtext.WidthTable(None, None)
+        table.latin1[ord("a")] = table.latin1[ord(" ")] = 6
+        table.other["\u65e5"] = 13
+        lines = ["a \u65e5\u65e5", "\x02\u65e5"]
+
+        # the characters after the space overflow the next subline, too, and
+        # a subline keeps at least one visible character
+        breaks = [[(0, 1), (2, 3), (3, 4)], [(0, 2)]]
+        self.assertEqual(breaks, [[(start, end) for start, end, style in xtext.find_breaks(line, 12, lambda bold: table)]
+                                  for line in lines])
+        if xtext.numpy is not None:
+            self.assertEqual(breaks, [[(start, end) for start, end, style in line_breaks]
+                                      for line_breaks in xtext.find_breaks_batch(lines, 12, lambda bold: table)])
+        self.assertEqual([(0, 1), (2, 3), (3, 4)],
+                         [(start, end) for start, end, style in xtext.find_breaks(lines[0], 25, lambda bold: table)])
+
+    @unittest.skipIf(xtext.numpy is None, "NumPy is not installed")
+    def test_find_breaks_batch(self):
+        widget = self.xtext
+        lines = ["", "aaaa aaaa aaaa", "\x02bbbbbbbbbbbbbbbbbbbbbbbb", "cc\x034,12 dd\x03 ee \x1fff\x0f gg hh",
+                 "ii\x03", "12 jjjjjjjjj \x02kkkkk\x02 llllllll mmmm", "\u20ac\u20ac \u6f22\u6f22\u6f22 nn"]
+        for width in (1, self.rect.width // 2, self.rect.width, self.rect.width * 10):
+            self.assertEqual([list(xtext.find_breaks(line, width, widget.get_width_table)) for line in lines],
+                             xtext.find_breaks_batch(lines, width, widget.get_width_table))
+
+        widget.batch_wrap = True
+        widget.batch_size = 3
+        widget.buffer = lines
+        widget.size_allocate_cb(self.rect)
+        sublines = list(widget.sublines)
+        widget.batch_wrap = False
+        widget.redraw()
+        widget.size_allocate_cb(self.rect)
+        self.assertEqual(sublines, widget.sublines)
+
+    def test_no_rewrap_on_same_width(self):
+        xtext = self.xtext
+        xtext.buffer = ["aaaa aaaa aaaa"]
+        xtext.size_allocate_cb(self.rect)
+        sublines = xtext.sublines
+        xtext.size_allocate_cb(self.rect)
+        self.assertIs(sublines, xtext.sublines)
+
+    def test_push_lines(self):
+        xtext = self.xtext
+        xtext.size_allocate_cb(self.rect)
+        threads = [threading.Thread(target=xtext.push_lines, args=(["%d %d" % (t, i) for i in range(100)],))
+                   for t in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], list(xtext.buffer))
+        self.assertIsNotNone(xtext.pending_source)
+
+        xtext.flush_pending_lines()
+        self.assertEqual(400, len(xtext.buffer))
+        self.assertEqual(400, len(xtext.sublines))
+        self.assertEqual(set("%d %d" % (t, i) for t in range(4) for i in range(100)), set(xtext.buffer))
+        self.assertIsNone(xtext.pending_source)
+
+    def test_line_source(self):
+        widget = self.xtext
+        data = "first\r\nzw\u00f6lf \u20ac\n\nlast".encode()
+
+        async def chunks():
+            for i in range(0, len(data), 3):
+                yield data[i:i + 3]
+
+        async def flush():
+            while True:
+                await asyncio.sleep(0)
+                widget.flush_pending_lines()
+
+        async def main():
+            flusher = asyncio.ensure_future(flush())
+            await source.run()
+            flusher.cancel()
+
+        source = xtext.LineSource(widget, chunks(), max_pending=0)
+        asyncio.run(main())
+        widget.flush_pending_lines()
+        self.assertEqual(["first", "zw\u00f6lf \u20ac", "", "last"], list(widget.buffer))
+        self.assertEqual([], widget.pending_listeners)
+
+    def test_lazy_wrap(self):
+        xtext = self.xtext
+        xtext.lazy_wrap = True
+        xtext.buffer = ["aaaaaaaa aaaaaaaa aa", "bb", "c" * 15, "dd"]
+        xtext.size_allocate_cb(self.rect)
+        self.assertEqual([None] * 4, xtext.sublines.lines)
+        self.assertEqual([2, 1, 2, 1], list(xtext.sublines.counts))
+        self.assertEqual(6, len(xtext.sublines))
+
+        self.assertEqual("aaaaaaaa", xtext.sublines[0][1])
+        self.assertEqual([3, 1, 2, 1], list(xtext.sublines.counts))
+        self.assertEqual(7, len(xtext.sublines))
+        self.assertEqual([None] * 3, list(xtext.sublines.lines)[1:])
+        self.assertEqual("bb", xtext.sublines[3][1])
+        self.assertEqual("c" * 5, xtext.sublines[5][1])
+        self.assertEqual("dd", xtext.sublines[6][1])
+        with self.assertRaises(IndexError):
+            xtext.sublines[7]
+
+        sublines = list(xtext.sublines)
+        xtext.lazy_wrap = False
+        xtext.redraw()
+        xtext.size_allocate_cb(self.rect)
+        self.assertEqual(sublines, list(xtext.sublines))
+
+    def test_lazy_selection(self):
+        xtext = self.xtext
+        xtext.buffer = ["aaaaaaaa aaaaaaaa aa", "bbbbbbbb bbbbbbbb bb", "cc"]
+        xtext.size_allocate_cb(self.rect)
+        xtext.selection_start = 1, 2
+        xtext.selection_end = 6, 1
+        text = "aaaaaa aa\nbbbbbbbb bbbbbbbb bb\nc"
+        self.assertEqual(text, xtext.get_selection())
+
+        xtext.lazy_wrap = True
+        self.rect.width -= 1
+        xtext.size_allocate_cb(self.rect)
+        self.assertEqual(text, xtext.get_selection())
+
+        # wrapping the line of one end does not move the other one
+        xtext.selection_start, xtext.selection_end = xtext.selection_end, xtext.selection_start
+        self.rect.width += 1
+        xtext.size_allocate_cb(self.rect)
+        self.assertEqual(text, xtext.get_selection())
+
+    def test_file_buffer(self):
+        widget = self.xtext
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "log")
+            with open(path, "w") as f:
+                f.write("aaaaaaaa aaaaaaaa aa\nbbbbbbbb bbbbbbbb bb\n")
+            with xtext.FileBuffer(path) as lines:
+                widget.buffer = lines
+                self.assertIs(lines, widget.buffer)
+                self.assertEqual(40, widget.buffer_bytes)
+                widget.append_line("cc")
+                widget.size_allocate_cb(self.rect)
+                self.assertTrue(all(sublines is None for sublines in widget.sublines.lines))
+                widget.selection_start = widget.sublines.from_line_pos(0, 11)
+                widget.selection_end = widget.sublines.from_line_pos(2, 1)
+                self.assertEqual("aaaaaa aa\nbbbbbbbb bbbbbbbb bb\nc", widget.get_selection())
+
+    def test_background_rewrap(self):
+        xtext = self.xtext
+        xtext.background_rewrap_lines = 2
+        xtext.scrollback_lines = 6
+        xtext.buffer = ["aaaa aaaa aaaa", "bb", "cc", "dd", "ee"]
+        xtext.size_allocate_cb(self.rect)
+        xtext.selection_start = 0, 5
+        xtext.selection_end = 3, 1
+        self.assertEqual(2, len(xtext.sublines.get_line(0)))
+
+        # the old sublines are kept until the thread is done
+        sublines = xtext.sublines
+        self.rect.width *= 2
+        xtext.size_allocate_cb(self.rect)
+        self.assertIs(sublines, xtext.sublines)
+        xtext.append_lines(["ff", "gg"])
+        self.assertEqual(["bb", "cc", "dd", "ee", "ff", "gg"], list(xtext.buffer))
+
+        while xtext.rewrap_width is not None:
+            GLib.MainContext.default().iteration(False)
+        xtext.rewrap_thread.join()
+        self.assertIsNot(sublines, xtext.sublines)
+        self.assertEqual(self.rect.width, xtext.wrap_width)
+        self.assertEqual(["bb", "cc", "dd", "ee", "ff", "gg"], [text for attrs, text in xtext.sublines])
+        self.assertEqual("bb\nc", xtext.get_selection())
+
+    def test_cancel_background_rewrap(self):
+        xtext = self.xtext
+        xtext.background_rewrap_lines = 2
+        xtext.buffer = ["aaaa aaaa aaaa", "bb", "cc"]
+        xtext.size_allocate_cb(self.rect)
+        width = self.rect.width
+        self.rect.width = 2 * width
+        xtext.size_allocate_cb(self.rect)
+        self.rect.width = width
+        xtext.size_allocate_cb(self.rect)
+        self.assertIsNone(xtext.rewrap_width)
+        xtext.rewrap_thread.join()
+        for _ in range(10):
+            GLib.MainContext.default().iteration(False)
+        self.assertEqual(width, xtext.wrap_width)
+
+    def test_width_table(self):
+        xtext = self.xtext
+        table = xtext.get_width_table(False)
+        self.assertIs(table, xtext.get_width_table(False))
+        self.assertIsNot(table, xtext.get_width_table(True))
+
+        for char in "a\xe9\u4e2d\U0001f600":
+            layout = xtext.create_pango_layout(char)
+            layout.set_font_description(xtext.fonts["normal"])
+            self.assertEqual(layout.get_pixel_size()[0], table.char_width(char))
+        self.assertIn("\u4e2d", table.other)
+        self.assertEqual(3 * table.char_width("a"), table.text_width("aaa"))
+
+        xtext.fonts["normal"] = xtext.fonts["bold"]
+        self.assertIsNot(table, xtext.get_width_table(False))
+
+    def test_scrollback_limits(self):
+        xtext = self.xtext
+        xtext.size_allocate_cb(self.rect)
+        xtext.scrollback_lines = 3
+        xtext.append_lines(["a" * 15, "bb", "cccc cccc cccc", "dd"])
+        self.assertEqual(["bb", "cccc cccc cccc", "dd"], xtext.buffer)
+        self.assertEqual([1, 2, 1], list(xtext.sublines.counts))
+        self.assertEqual(["bb", "cccc cccc", "cccc", "dd"], [text for attrs, text in xtext.sublines])
+
+        xtext.scrollback_bytes = 5
+        xtext.trim_scrollback()
+        self.assertEqual(["dd"], xtext.buffer)
+        self.assertEqual(2, xtext.buffer_bytes)
+        self.assertEqual(1, len(xtext.sublines))
+
+    def test_evict_selection(self):
+        xtext = self.xtext
+        xtext.size_allocate_cb(self.rect)
+        xtext.append_lines(["a" * 15, "bb", "cc"])
+        xtext.selection_start = 3, 1
+        xtext.selection_end = 1, 3
+        xtext.start_subline = 1
+        xtext.evict_lines(1)
+        self.assertEqual((1, 1), xtext.selection_start)
+        self.assertEqual((0, 0), xtext.selection_end)
+        self.assertEqual(0, xtext.start_subline)
+        self.assertEqual("bb\nc", xtext.get_selection())
+
+        xtext.evict_lines(2)
+        self.assertIsNone(xtext.selection_start)
+        self.assertIsNone(xtext.selection_end)
+
+    def test_evict_frame(self):
+        widget = self.xtext
+        widget.size_allocate_cb(self.rect)
+        widget.append_lines(["line %d" % i for i in range(20)])
+        widget.start_subline = 10
+        height = 5 * widget.fontheight
+        widget.render_frame(100, height)
+
+        rendered = []
+        get_subline_surface = widget.get_subline_surface
+
+        def record(attrs, text, subline_no, width):
+            rendered.append(subline_no)
+            return get_subline_surface(attrs, text, subline_no, width)
+        widget.get_subline_surface = record
+
+        # the rows of the last frame are moved with the evicted lines
+        widget.evict_lines(3)
+        self.assertEqual(7, widget.start_subline)
+        widget.render_frame(100, height)
+        self.assertEqual([], rendered)
+        self.assertEqual("line 10", widget.sublines[widget.start_subline][1])
+
+    def test_evict_scrolls_adjustment(self):
+        scrollable = xtext.ScrollableXText()
+        widget = scrollable.xtext
+        widget.scrollback_lines = None
+        rect = Gdk.Rectangle()
+        rect.x = rect.y = 0
+        rect.width = self.rect.width
+        rect.height = 10 * widget.fontheight
+        widget.buffer = ["line %d" % i for i in range(100)]
+        widget.size_allocate(rect)
+        widget.scroll_to_subline(45)
+        self.assertAlmostEqual(45 / 90, scrollable.adjustment.get_value())
+
+        # the adjustment follows lines evicted and inserted before the display
+        widget.evict_lines(10)
+        self.assertEqual(35, widget.start_subline)
+        self.assertAlmostEqual(35 / 80, scrollable.adjustment.get_value())
+        widget.replace_lines(0, 0, ["new 1", "new 2"])
+        self.assertEqual(37, widget.start_subline)
+        self.assertAlmostEqual(37 / 82, scrollable.adjustment.get_value())
+        scrollable.adjustment.value_changed()
+        self.assertEqual((37, 0), (widget.start_subline, widget.start_offset))
+        self.assertEqual("line 45", widget.sublines[widget.start_subline][1])
+
+
+
+class SearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.xtext = xtext.XText()
+
+        class Rect:
+            pass
+        self.rect = Rect()
+        layout = self.xtext.create_pango_layout("a")
+        layout.set_font_description(self.xtext.fonts["normal"])
+        self.rect.width = 10 * layout.get_pixel_size()[0]
+
+    def test_search(self):
+        widget = self.xtext
+        M = xtext.SearchMatch
+        widget.buffer = ["hello world", "\x02Hel\x02lo again", "nothing", "say hello"]
+        widget.size_allocate_cb(self.rect)
+
+        self.assertEqual([M(0, 0, 5), M(1, 1, 7), M(3, 4, 9)], widget.search("hello"))
+        self.assertEqual([M(3, 4, 9)], widget.search("hello", case=True)[1:])
+        self.assertEqual([M(0, 0, 2), M(1, 1, 3)], widget.search("^he", regex=True))
+        self.assertEqual([M(0, 4, 5), M(0, 7, 8), M(1, 6, 7), M(2, 1, 2), M(3, 8, 9)], widget.search("o"))
+        self.assertEqual([], widget.search(""))
+
+        widget.search("hello")
+        self.assertEqual(M(0, 0, 5), widget.search_next())
+        self.assertEqual(M(1, 1, 7), widget.search_next())
+        self.assertEqual(((1, 7, True),), widget.get_subline_highlights(2))
+        self.assertEqual(M(0, 0, 5), widget.search_previous())
+        self.assertEqual(M(3, 4, 9), widget.search_previous())
+
+        # the index and the matches follow appended and evicted lines
+        widget.scrollback_lines = 4
+        widget.append_lines(["hello again", "bye"])
+        self.assertEqual([M(1, 4, 9), M(2, 0, 5)], widget.get_search_matches())
+        self.assertEqual(0, widget.search_current)
+        self.assertEqual([M(2, 6, 11)], widget.search("again"))
+        self.assertEqual(2, widget.search_index.first)
+        self.assertIn(5, widget.search_index.candidates(["bye"]))
+
+        # and inserted lines
+        index = widget.search_index
+        widget.scrollback_lines = None
+        widget.replace_lines(1, 0, ["again and again"])
+        self.assertEqual([M(1, 0, 5), M(1, 10, 15), M(3, 6, 11)], widget.search("again"))
+        self.assertIs(index, widget.search_index)
+
+    def test_search_scrolls_adjustment(self):
+        scrollable = xtext.ScrollableXText()
+        widget = scrollable.xtext
+        rect = Gdk.Rectangle()
+        rect.x = rect.y = 0
+        rect.width = self.rect.width
+        rect.height = 10 * widget.fontheight
+        widget.buffer = ["line %d" % i for i in range(100)]
+        widget.size_allocate(rect)
+        self.assertEqual(10, widget.max_lines)
+
+        # the match is scrolled to with the adjustment of the scrollbar
+        widget.search("line 50")
+        self.assertEqual(xtext.SearchMatch(50, 0, 7), widget.search_next())
+        self.assertEqual((45, 0), (widget.start_subline, widget.start_offset))
+        self.assertAlmostEqual(45 / 90, scrollable.adjustment.get_value())
+
+        # scrolling and resizing go on from there
+        class Event:
+            direction = Gdk.ScrollDirection.DOWN
+        scrollable.scroll_cb(widget, Event)
+        self.assertEqual((46, 0), (widget.start_subline, widget.start_offset))
+        widget.size_allocate(rect)
+        self.assertEqual((46, 0), (widget.start_subline, widget.start_offset))
+
+    def test_search_index(self):
+        index = xtext.SearchIndex(block_size=2)
+        for text in ["abcd", "bcde", "xyz", "abc", "xxx"]:
+            index.add(text)
+        self.assertEqual([0, 1, 2, 3], index.candidates(["abc"]))
+        self.assertEqual([0, 1], index.candidates(["bcd"]))
+        self.assertEqual([], index.candidates(["abc", "yyy"]))
+        self.assertIsNone(index.candidates(["ab"]))
+        index.evict(3)
+        self.assertEqual([3], index.candidates(["ABC"]))
+        self.assertEqual([], index.candidates(["bcd"]))
+        self.assertNotIn("bcd", index.postings)
+
+        # inserted and deleted lines move the blocks after them
+        index.splice(3, 0, ["bcd", "bcd"])  # the block of line 3 grows
+        self.assertEqual([3, 4, 5], index.candidates(["bcd"]))
+        self.assertEqual([3, 4, 5], index.candidates(["abc"]))
+        self.assertEqual([6], index.candidates(["xxx"]))
+        index.splice(3, 3, ["xyz"])
+        self.assertEqual([3], index.candidates(["xyz"]))
+        self.assertEqual([4], index.candidates(["xxx"]))
+        self.assertEqual(2, len(index))
+
+    def test_regex_literals(self):
+        self.assertEqual(["hello"], xtext.regex_literals("hello"))
+        self.assertEqual(["hel", "o wo", "ld"], xtext.regex_literals("hel+o wor?ld"))
+        self.assertEqual(["foo", "baz"], xtext.regex_literals("foo(bar)?baz"))
+        self.assertEqual(["x", "yz"], xtext.regex_literals("x[abc]yz\\d{2}"))
+        self.assertEqual([], xtext.regex_literals("foo|bar"))
+        self.assertEqual([], xtext.regex_literals("(?i)foo"))
+
+
+class RendererTest(unittest.TestCase):
+
+    def test_renderer(self):
+        renderer = xtext.Renderer()
+        widget = xtext.XText()
+        lines = ["aaaa aaaa aaaa", "\x02bbbbbbbbbbbbbbbbbbbbbbbb", "cc"]
+        width = 10 * renderer.get_width_table(False).char_width("a")
+        self.assertEqual([s for line in lines for s in widget.break_line(line, width)],
+                         renderer.wrap_lines(lines, width))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "page-%d.png")
+            height = 2 * renderer.fontheight
+            paths = renderer.render_pages(lines, width, height, path)
+            self.assertEqual([path % page for page in range(1, 4)], paths)
+            self.assertTrue(all(os.path.exists(path) for path in paths))
+            self.assertEqual([path % 1], renderer.render_pages([], width, height, path))
+            path = os.path.join(directory, "page-%d.svg")
+            self.assertEqual([path % 1], renderer.render_pages(["x"], width, height, path))
+            with self.assertRaises(ValueError):
+                renderer.render_pages(lines, width, height, "page-%d.pdf")
+
+
+class StatsTest(unittest.TestCase):
+
+    def test_stats(self):
+        widget = xtext.XText()
+        calls = []
+        widget.stats = stats = xtext.Stats(calls.append)
+        widget.buffer = ["aaaa aaaa aaaa", "bb"]
+        rect = Gdk.Rectangle()
+        rect.x = rect.y = 0
+        rect.width = 10 * widget.get_width_table(False).char_width("a")
+        rect.height = 100
+        widget.size_allocate(rect)
+        self.assertEqual(1, stats.counts["rewrap"])
+        self.assertEqual(2, stats.counts["break_line"])
+
+        cr = cairo.Context(cairo.ImageSurface(cairo.FORMAT_RGB24, 100, 100))
+        widget.do_draw(cr)
+        widget.do_draw(cr)
+        self.assertEqual([stats, stats], calls)
+        self.assertEqual(2, stats.counts["frame"])
+        self.assertEqual(len("aaaa aaaa" "aaaa" "bb"), stats.counts["frame_chars"])
+        self.assertEqual((stats.last_frame[0], 0), stats.last_frame)  # nothing changed
+
+        widget.selection_start = 0, 0
+        widget.set_selection_end((1, 2))
+        widget.find_char_at_pos(0, 0)
+        self.assertEqual(1, stats.counts["selection_update"])
+        self.assertEqual(2, stats.counts["selection_rows"])
+        self.assertEqual(1, stats.counts["hit_test"])
+        self.assertGreater(stats.times["hit_test"], 0)
+        widget.do_draw(cr)
+        self.assertEqual(5, stats.counts["subline_cache_miss"])  # 3 sublines, then 2 with a new selection
+        self.assertEqual(0.0, stats.hit_rate("subline_cache"))
+        self.assertIn("selection_rows", stats.report())
+        self.assertEqual(stats.counts["frame"], stats.snapshot()["counts"]["frame"])
+
+        stats.reset()
+        self.assertEqual({}, stats.counts)
+
+
+class RingBufferTest(unittest.TestCase):
+
+    def test_ring_buffer(self):
+        r = xtext.RingBuffer(range(5))
+        self.assertEqual([0, 1], r.popleft(2))
+        self.assertEqual([2, 3, 4], r)
+        self.assertEqual([3, 4], r[1:])
+        self.assertEqual(4, r[-1])
+        r.append(5)
+        r.insert(0, 1)
+        del r[1]
+        self.assertEqual([1, 3, 4, 5], r)
+        self.assertEqual([1, 3, 4, 5], r.popleft(10))
+        self.assertEqual(0, len(r))
+        with self.assertRaises(IndexError):
+            r[0]
+
+
+class FileBufferTest(unittest.TestCase):
+
+    def test_file_buffer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "log")
+            with open(path, "wb") as f:
+                f.write("a\nb\u00e4\r\nc".encode())
+            with xtext.FileBuffer(path) as f:
+                self.assertEqual(["a", "b\u00e4", "c"], list(f))
+                f.extend(["d", "e"])
+                self.assertEqual("e", f[-1])
+                self.assertEqual(["c", "d"], f[2:4])
+                self.assertEqual(["a"], f.popleft())
+                self.assertEqual(7, f.nbytes)
+                with self.assertRaises(ValueError):
+                    f.append("f\ng")
+            with open(path, "rb") as f:
+                self.assertEqual("a\nb\u00e4\r\nc\nd\ne\n".encode(), f.read())
+
+            # the index is reused if the file did not change
+            with xtext.FileBuffer(path) as f:
+                self.assertEqual(f.offsets, f.load_index())
+                self.assertEqual(["a", "b\u00e4", "c", "d", "e"], list(f))
+
+            # the file is scanned again if it changed
+            with open(path, "ab") as f:
+                f.write(b"f\n")
+            with xtext.FileBuffer(path) as f:
+                self.assertEqual(["a", "b\u00e4", "c", "d", "e", "f"], list(f))
+                self.assertEqual([1, 4, 1, 1, 1, 1], f.line_lengths())
+            with open(path, "wb") as f:
+                f.write(b"x\n")
+            with xtext.FileBuffer(path) as f:
+                self.assertEqual(["x"], list(f))
+
+            # also if it was rewritten in place with the same size
+            with xtext.FileBuffer(path) as f:
+                f.extend(["yy", "z"])
+            stat = os.stat(path)
+            with open(path, "r+b") as f:
+                f.write(b"x\nyyy\n\n")
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            with xtext.FileBuffer(path) as f:
+                self.assertEqual(["x", "yyy", ""], list(f))
+
+            # the file is only opened for writing to append lines
+            with xtext.FileBuffer(path) as f:
+                self.assertFalse(f.file.writable())
+                f.append("w")
+                self.assertTrue(f.file.writable())
+                self.assertEqual(["x", "yyy", "", "w"], list(f))
+
+            # the index is not saved if its file cannot be written
+            os.remove(path + ".idx")
+            os.mkdir(path + ".idx")
+            f = xtext.FileBuffer(path)
+            f.close()
+            self.assertTrue(f.file.closed)
+            self.assertIsNone(f.map)
+
+
+class FenwickTreeTest(unittest.TestCase):
+
+    def test_fenwick_tree(self):
+        values = [3, 1, 4, 1, 5, 9, 2, 6]
+        t = xtext.FenwickTree(values)
+        for i in range(len(values) + 1):
+            self.assertEqual(sum(values[:i]), t.prefix(i))
+        self.assertEqual([0, 0, 0, 1, 2, 2, 2, 2, 3], [t.search(x) for x in range(9)])
+        self.assertEqual(8, t.search(31))
+
+        t[2] = 0
+        values[2] = 0
+        t.append(7)
+        values.append(7)
+        self.assertEqual(values, list(t))
+        for i in range(len(values) + 1):
+            self.assertEqual(sum(values[:i]), t.prefix(i))
+
+        self.assertEqual(4, t.popleft(3))
+        values = values[3:]
+        self.assertEqual(values, list(t))
+        self.assertEqual(1, t.search(1))
+        self.assertEqual(sum(values), t.prefix(len(t)))
+        self.assertEqual(6, t.popleft(2))
+        values = values[2:]
+        t.append(1)
+        values.append(1)
+        for i in range(len(values) + 1):
+            self.assertEqual(sum(values[:i]), t.prefix(i))
+            if i < len(values):
+                self.assertEqual(i, t.search(sum(values[:i])))
+
+        t.splice(1, 1, [8])
+        values[1:2] = [8]
+        t.splice(0, 2, [2, 0, 5])
+        values[0:2] = [2, 0, 5]
+        self.assertEqual(values, list(t))
+        for i in range(len(values) + 1):
+            self.assertEqual(sum(values[:i]), t.prefix(i))
+
+        # only the nodes after a splice are computed again
+        values = list(range(50))
+        t = xtext.FenwickTree(values)
+        t.popleft(5)
+        values = values[5:]
+        for index, count, new in [(20, 3, [1]), (0, 0, [7, 7]), (44, 0, [2]), (13, 10, []), (31, 1, [0, 0, 0])]:
+            t.splice(index, count, new)
+            values[index:index + count] = new
+            self.assertEqual(values, list(t))
+            self.assertEqual([sum(values[:i]) for i in range(len(values) + 1)],
+                             [t.prefix(i) for i in range(len(values) + 1)])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -24,15 +24,33 @@ FROM, OUT OF OR IN CONNECTION  WITH  THE  SOFTWARE  OR  THE  USE  OR  OTHER
 DEALINGS IN THE SOFTWARE.
 """
 
+import re
 import enum
+import codecs
+import asyncio
+import bisect
+import os
+import array
 import cairo
 import math
+import time
+import mmap
 import functools
+import itertools
+import operator
+import threading
+import collections
+import collections.abc
 
-from gi.repository import Gtk, Gdk, Pango, PangoCairo
+from gi.repository import Gtk, Gdk, GLib, Pango, PangoCairo
 from contextlib import contextmanager
 
-__all__ = ["XText", "ScrollableXText", "FormatType", "Color", "ColorCode"]
+try:
+    import numpy
+except ImportError:  # optional, only used by find_breaks_batch
+    numpy = None
+
+__all__ = ["XText", "ScrollableXText", "LineSource", "FileBuffer", "FormatType", "Color", "ColorCode", "SearchMatch", "Link", "Renderer", "Stats"]
 
 
 def halfpx(*args):
@@ -77,20 +95,7 @@ def strip_attributes(text):
     """
     Remove attributes (bold, underline, color) from a text.
     """
-    text = text.replace(FormatType.BOLD, "").replace(FormatType.RESET, "").replace(FormatType.UNDERLINE, "")
-    parts = text.split(FormatType.COLOR)
-    for p in range(len(parts[1:])):
-        part = parts[p+1]
-        if part[0:1] in "0123456789":
-            part = part[1:]
-            if part[0:1] in "0123456789":
-                part = part[1:]
-        if part[0:1] == "," and part[1:2] in "0123456789":
-            part = part[2:]
-            if part[0:1] in "0123456789":
-                part = part[1:]
-        parts[p+1] = part
-    return "".join(parts)
+    return FORMAT_RE.sub("", text)
 
 
 class FormatType(str, enum.Enum):
@@ -188,448 +193,3337 @@ class Color:
         return "%s%s" % (other, self)
 
 
-class XText(Gtk.Misc):
-    __gtype_name__ = 'XText'
+class RingBuffer(collections.abc.MutableSequence):
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    """
+    A list that supports removing items from the front in amortized constant
+    time.
 
-        self.add_events(Gdk.EventMask.BUTTON_PRESS_MASK |
-                        Gdk.EventMask.BUTTON_RELEASE_MASK |
-                        Gdk.EventMask.POINTER_MOTION_MASK)
-        self.clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
-        self.connect("size-allocate", XText.size_allocate_cb)
+    Usage:
+    >>> r = RingBuffer([1, 2, 3])
+    >>> r.popleft(2)
+    [1, 2]
+    >>> r.append(4)
+    >>> list(r)
+    [3, 4]
+    """
 
-        self.selection_active = False
-        self.selection_start = None
-        self.selection_end = None
+    def __init__(self, items=()):
+        self._items = list(items)
+        self._head = 0  # the index of the first item in self._items
+
+    def _index(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("ring buffer index out of range")
+        return self._head + index
+
+    def _slice(self, index):
+        start, stop, step = index.indices(len(self))
+        if step != 1:
+            raise ValueError("ring buffer slices must have a step of 1")
+        return slice(self._head + start, self._head + max(start, stop))
+
+    def __len__(self):
+        return len(self._items) - self._head
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                return list(self)[index]
+            return self._items[self._slice(index)]
+        return self._items[self._index(index)]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            self._items[self._slice(index)] = value
+        else:
+            self._items[self._index(index)] = value
 
-        self.buffer = []
-        self.buffer_indent = 50
-        self.margin = 2
-        self.sublines = []
-        self.start_subline = 0  # the first displayed subline
-        self.start_offset = 0  # the offset of the first subline
-        self.max_lines = 0.0  # maximal number of lines that fit into the widget height (float)
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            del self._items[self._slice(index)]
+        else:
+            del self._items[self._index(index)]
 
-        self.colors = {
-            "background":           color(0xf0f0, 0xf0f0, 0xf0f0),
-            "foreground":           color(0x2512, 0x29e8, 0x2b85),
-            "mark_backg":           color(0x2020, 0x4a4a, 0x8787),
-            "mark_foreg":           color(0xd3d3, 0xd7d7, 0xcfcf),
-            "light_sep":            color(0xffff, 0xffff, 0xffff),
-            "dark_sep":             color(0x1111, 0x1111, 0x1111),
-            "thin_sep":             color(0x8e38, 0x8e38, 0x9f38),
-            "text":                 color(0x0000, 0x0000, 0x0000),
-            ColorCode.WHITE:        color(0xd3d3, 0xd7d7, 0xcfcf),
-            ColorCode.BLACK:        color(0x2e2e, 0x3434, 0x3636),
-            ColorCode.BLUE:         color(0x3434, 0x6565, 0xa4a4),
-            ColorCode.GREEN:        color(0x4e4e, 0x9a9a, 0x0606),
-            ColorCode.RED:          color(0xcccc, 0x0000, 0x0000),
-            ColorCode.LIGHT_RED:    color(0x8f8f, 0x3939, 0x0202),
-            ColorCode.PURPLE:       color(0x5c5c, 0x3535, 0x6666),
-            ColorCode.ORANGE:       color(0xcece, 0x5c5c, 0x0000),
-            ColorCode.YELLOW:       color(0xc4c4, 0xa0a0, 0x0000),
-            ColorCode.LIGHT_GREEN:  color(0x7373, 0xd2d2, 0x1616),
-            ColorCode.AQUA:         color(0x1111, 0xa8a8, 0x7979),
-            ColorCode.LIGHT_AQUA:   color(0x5858, 0xa1a1, 0x9d9d),
-            ColorCode.LIGHT_BLUE:   color(0x5757, 0x7979, 0x9e9e),
-            ColorCode.LIGHT_PURPLE: color(0xa0d0, 0x42d4, 0x6562),
-            ColorCode.GREY:         color(0x5555, 0x5757, 0x5353),
-            ColorCode.LIGHT_GREY:   color(0x8888, 0x8a8a, 0x8585),
-        }
+    def __iter__(self):
+        return itertools.islice(self._items, self._head, None)
 
-        self.fonts = {
-            "normal": "Monospace 9",
-            "bold": "Monospace Bold 9",
-        }
-        for font in self.fonts:
-            self.fonts[font] = Pango.font_description_from_string(self.fonts[font])
+    def __eq__(self, other):
+        if not isinstance(other, collections.abc.Sequence):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
 
-        pcx = self.create_pango_context()
-        metrics = pcx.get_metrics(self.fonts["normal"])
-        self.ascent = metrics.get_ascent() // Pango.SCALE
-        self.fontheight = (metrics.get_ascent() + metrics.get_descent()) // Pango.SCALE
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, list(self))
 
-    @functools.lru_cache(maxsize=128)
-    def get_pango_layout(self, char, bold):
-        layout = self.create_pango_layout(char)
-        layout.set_font_description(self.fonts["bold" if bold else "normal"])
-        return layout, layout.get_pixel_size()
+    def insert(self, index, value):
+        index = max(0, min(len(self), index + len(self) if index < 0 else index))
+        self._items.insert(self._head + index, value)
 
-    def redraw(self):
-        self.size_allocate_cb(self.get_allocation())
-        self.queue_draw()
+    def append(self, value):
+        self._items.append(value)
 
-    def break_line(self, line, max_width):
+    def extend(self, values):
+        self._items.extend(values)
+
+    def popleft(self, count=1):
         """
-        Break buffer lines into sublines if they are longer than the widget
-        width.
+        Remove the first count items and return them as a list.
         """
-        bold = False
-        fcolor = None
-        bcolor = None
-        underline = False
-        startattrs = dict(bold=bold, fcolor=fcolor, bcolor=bcolor, underline=underline, first_subline=True)
+        count = min(count, len(self))
+        removed = self._items[self._head:self._head + count]
+        self._head += count
+        if self._head > len(self._items) // 2:
+            # compact, the removed part is at least as long as the rest
+            del self._items[:self._head]
+            self._head = 0
+        return removed
 
-        left = 0
-        text = line
-        i = -1
-        while text:
-            i += 1
-            c, text = text[0], text[1:]
-            if c == FormatType.BOLD:
-                bold = not bold
-                continue
-            if c == FormatType.COLOR:
-                fcolor = bcolor = None
-                if len(text) > 0 and text[0] in "0123456789":
-                    if len(text) > 1 and text[1] in "0123456789":
-                        fcolor, text = int(text[0:2]), text[2:]
-                        i += 2
-                    else:
-                        fcolor, text = int(text[0]), text[1:]
-                        i += 1
-                if len(text) > 1 and text[0] == "," and text[1] in "0123456789":
-                    if len(text) > 2 and text[2] in "0123456789":
-                        bcolor, text = int(text[1:3]), text[3:]
-                        i += 3
-                    else:
-                        bcolor, text = int(text[1]), text[2:]
-                        i += 2
-                else:
-                    bcolor = None
-                continue
-            if c == FormatType.RESET:
-                bold = underline = False
-                fcolor = bcolor = None
-                continue
-            if c == FormatType.UNDERLINE:
-                underline = not underline
-                continue
 
-            layout, (width, height) = self.get_pango_layout(c, bold)
-            left += width
+class VersionedDict(dict):
 
-            if left > max_width:
-                offset = 0
-                for j in range(min(25, i)):
-                    if line[i - j] == " ":
-                        i -= j
-                        offset = 1
-                        break
-                startattrs["offset"] = offset
-                yield startattrs, line[:i]
-                startattrs = dict(bold=bold, fcolor=fcolor, bcolor=bcolor, underline=underline, first_subline=False)
-                text = line = line[i+offset:]
-                left = 0
-                i = -1
+    """
+    A dict that gets a new version each time it is changed.
 
-        startattrs["offset"] = 0
-        yield startattrs, line
+    The versions are unique among all versioned dicts, so caches that  keep
+    the version of a dict notice changes of the dict and its replacement by
+    another one.
 
-    def do_draw(self, cr):
+    Usage:
+    >>> d = VersionedDict(a=1)
+    >>> version = d.version
+    >>> d["a"] = 2
+    >>> d.version == version
+    False
+    """
+
+    versions = itertools.count()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = next(self.versions)
+
+    def changed(self):
+        self.version = next(self.versions)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.changed()
+
+    def clear(self):
+        super().clear()
+        self.changed()
+
+    def pop(self, *args):
+        try:
+            return super().pop(*args)
+        finally:
+            self.changed()
+
+    def popitem(self):
+        try:
+            return super().popitem()
+        finally:
+            self.changed()
+
+    def setdefault(self, key, default=None):
+        try:
+            return super().setdefault(key, default)
+        finally:
+            self.changed()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.changed()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+
+class FileBuffer(collections.abc.Sequence):
+
+    """
+    Buffer lines stored in an append-only file and read through mmap.
+
+    The lines are terminated by "\\n" in the file, a trailing "\\r" is removed
+    when a line is read.  Only an index of the line offsets is kept in memory,
+    so the lines are decoded when they are accessed.  Assign it to XText.buffer
+    to display files that are too big for a list of str, the lines are then
+    wrapped lazily.
+
+    The file is opened read-only until lines are appended, so read-only logs
+    can be viewed too.  A missing file is created.
+
+    The index is saved to path + ".idx" on close() together with the size,
+    the modification time and the inode of the file.  It is reused when the
+    file is opened again and none of them changed, otherwise the file is
+    scanned again.  The index is only a cache, close() ignores errors while
+    saving it.
+
+    Usage:
+    >>> with FileBuffer("channel.log") as lines:
+    ...     lines.append("hello")
+    ...     lines[-1]
+    'hello'
+    """
+
+    def __init__(self, path, encoding="utf-8", errors="replace"):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.encoding = encoding
+        self.errors = errors
+        self.file = open(path, "rb") if os.path.exists(path) else open(path, "a+b")
+        self.map = None
+        self.mapped = 0  # the number of bytes that are written and mapped
+        self.head = 0  # the index of the first line in self.offsets
+        self.offsets = self.load_index()  # the start of each line and the end of the last line
+        self.partial = False  # whether the last line is not terminated
+        self.scan()
+
+    def file_stamp(self):
         """
-        Draw the widget graphics.
+        Return the size, the modification time and the inode of the file,
+        which are saved with the index.
         """
-        self.buffer_indent = max(self.buffer_indent, self.margin)
+        self.file.flush()
+        stat = os.fstat(self.file.fileno())
+        return array.array("Q", [stat.st_size, stat.st_mtime_ns, stat.st_ino])
 
-        # draw background
-        self.set_source_color(cr, "background")
-        cr.paint()
+    def load_index(self):
+        """
+        Return the saved line offsets if they match the file, otherwise the
+        offsets of an empty file.
 
-        # draw lines
-        with saved(cr):
-            for i, (attrs, subline) in enumerate(self.sublines[self.start_subline:self.start_subline + int(self.max_lines + 1)]):
-                self.draw_line(cr, attrs, subline, i + self.start_subline, self.fontheight * i - self.start_offset)
+        The file was rotated, truncated or rewritten if its stamp changed, so
+        the offsets are only used if the saved stamp is the same.
+        """
+        offsets = array.array("Q")
+        try:
+            with open(self.index_path, "rb") as f:
+                offsets.frombytes(f.read())
+        except (OSError, ValueError):
+            return array.array("Q", [0])
+        stamp = self.file_stamp()
+        if offsets[:len(stamp)] != stamp:
+            return array.array("Q", [0])
+        offsets = offsets[len(stamp):]
+        self.remap()
+        end = offsets[-1] if offsets else -1
+        if not offsets or offsets[0] != 0 or end > self.mapped or \
+           end and self.map[end - 1:end] != b"\n":
+            return array.array("Q", [0])
+        return offsets
+
+    def save_index(self):
+        """
+        Save the stamp of the file and the offsets of the terminated lines  to
+        path + ".idx".
+        """
+        offsets = self.offsets[:-1] if self.partial else self.offsets
+        with open(self.index_path, "wb") as f:
+            self.file_stamp().tofile(f)
+            offsets.tofile(f)
 
-        # self.draw_sep(cr)
+    def remap(self):
+        """
+        Map the file again after it was written.
+        """
+        self.file.flush()
+        size = os.fstat(self.file.fileno()).st_size
+        if size != self.mapped:
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ) if size else None
+            self.mapped = size
+
+    def scan(self):
+        """
+        Index the lines after the last indexed line.
+        """
+        self.remap()
+        pos = self.offsets[-1]
+        while pos < self.mapped:
+            end = self.map.find(b"\n", pos)
+            if end < 0:
+                self.offsets.append(self.mapped)
+                self.partial = True
+                break
+            pos = end + 1
+            self.offsets.append(pos)
+
+    def close(self):
+        try:
+            self.save_index()
+        except OSError:
+            pass  # the file is scanned again when it is opened the next time
+        finally:
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.offsets) - 1 - self.head
+
+    def _index(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("file buffer index out of range")
+        return self.head + index
+
+    def _line(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        if end > self.mapped:
+            self.remap()
+        data = self.map[start:end]
+        if data.endswith(b"\n"):
+            data = data[:-1]
+        if data.endswith(b"\r"):
+            data = data[:-1]
+        return data.decode(self.encoding, self.errors)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            return [self._line(self.head + i) for i in range(start, stop, step)]
+        return self._line(self._index(index))
+
+    def __iter__(self):
+        for i in range(self.head, len(self.offsets) - 1):
+            yield self._line(i)
+
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, self.path)
+
+    def append(self, line):
+        self.extend([line])
+
+    def extend(self, lines):
+        if not self.file.writable():
+            file = open(self.path, "a+b")
+            self.file.close()  # the map keeps its own descriptor
+            self.file = file
+        data = []
+        pos = self.offsets[-1]
+        if self.partial:
+            # terminate the last line of the file
+            data.append(b"\n")
+            pos += 1
+            self.offsets[-1] = pos
+            self.partial = False
+        for line in lines:
+            if "\n" in line:
+                raise ValueError("buffer lines must not contain newlines")
+            encoded = line.encode(self.encoding) + b"\n"
+            data.append(encoded)
+            pos += len(encoded)
+            self.offsets.append(pos)
+        self.file.write(b"".join(data))
+
+    def popleft(self, count=1):
+        """
+        Remove the first count lines and return them as a list.
 
-    def draw_line(self, cr, attrs, text, subline_no, top=0):
+        The lines stay in the file, only the index is moved.
         """
-        Draw a subline.
+        count = min(count, len(self))
+        removed = self[:count]
+        self.head += count
+        return removed
+
+    def line_lengths(self):
+        """
+        Return the encoded length of each line without decoding the lines.
         """
-        bold = attrs["bold"]
-        fcolor = attrs["fcolor"]
-        bcolor = attrs["bcolor"]
-        underline = attrs["underline"]
+        offsets = self.offsets
+        return [offsets[i + 1] - offsets[i] - 1 for i in range(self.head, len(offsets) - 1)]
 
-        if self.selection_start is not None and self.selection_end is not None:
-            s_start, s_end = sorted([self.selection_start, self.selection_end])
-        else:
-            s_start = s_end = None
+    @property
+    def nbytes(self):
+        """
+        The encoded size of all lines without the newlines.
+        """
+        return self.offsets[-1] - self.offsets[self.head] - len(self) + self.partial
 
-        left = 0
-        i = -1
-        while text:
-            i += 1
-            c, text = text[0], text[1:]
-            if c == FormatType.BOLD:
-                bold = not bold
-                continue
-            if c == FormatType.COLOR:
-                fcolor = bcolor = None
-                if len(text) > 0 and text[0] in "0123456789":
-                    if len(text) > 1 and text[1] in "0123456789":
-                        fcolor, text = int(text[0:2]), text[2:]
-                        i += 2
-                    else:
-                        fcolor, text = int(text[0]), text[1:]
-                        i += 1
-                if len(text) > 1 and text[0] == "," and text[1] in "0123456789":
-                    if len(text) > 2 and text[2] in "0123456789":
-                        bcolor, text = int(text[1:3]), text[3:]
-                        i += 3
-                    else:
-                        bcolor, text = int(text[1]), text[2:]
-                        i += 2
-                else:
-                    bcolor = None
-                continue
-            if c == FormatType.RESET:
-                bold = underline = False
-                fcolor = bcolor = None
-                continue
-            if c == FormatType.UNDERLINE:
-                underline = not underline
-                continue
 
-            layout, (width, height) = self.get_pango_layout(c, bold)
+# a single format code: bold, reset, underline or color with optional
+# foreground and background numbers (one or two digits each)
+FORMAT_RE = re.compile("\x02|\x0F|\x1F|\x03([0-9]{1,2})?(?:,([0-9]{1,2}))?")
+COLOR_RE = re.compile("\x03([0-9]{1,2})?(?:,([0-9]{1,2}))?")
 
-            # draw background
-            cr.rectangle(left, top, width, height)
-            if s_start is not None and \
-               s_start <= (subline_no, i) < s_end:
-                self.set_source_color(cr, "mark_backg")
-            elif bcolor is None:
-                self.set_source_color(cr, "background")
-            else:
-                self.set_source_color(cr, bcolor % 16)
-            cr.fill()
 
-            # draw character
-            if s_start is not None and \
-               s_start <= (subline_no, i) < s_end:
-                self.set_source_color(cr, "mark_foreg")
-            elif fcolor is None:
-                self.set_source_color(cr, "text")
-            else:
-                self.set_source_color(cr, fcolor % 16)
-            cr.move_to(left, top)
-            PangoCairo.show_layout(cr, layout)
+class Style(collections.namedtuple("Style", "bold fcolor bcolor underline")):
 
-            # draw underline
-            if underline:
-                with saved(cr):
-                    cr.set_line_width(1)
-                    cr.set_line_cap(cairo.LINE_CAP_SQUARE)
-                    cr.move_to(*halfpx(left, top + self.ascent + 1))
-                    cr.line_to(*halfpx(left + width, top + self.ascent + 1))
-                    cr.stroke()
+    """
+    The text attributes that are active at a position of a line.
 
-            left += width
+    Usage:
+    >>> Style.from_attrs({"bold": True})
+    Style(bold=True, fcolor=None, bcolor=None, underline=False)
+    """
 
-    def draw_sep(self, cr, x):
-        """
-        Draw the separator line.
+    __slots__ = ()
 
-        (not used)
+    @classmethod
+    def from_attrs(cls, attrs):
         """
-        allocation = self.get_allocation()
-        height = allocation.height
+        Create a style from the attributes of a subline.
 
-        self.set_source_color(cr, "thin_sep")
-        cr.set_line_width(1)
-        cr.move_to(*halfpx(x, 0))
-        cr.line_to(*halfpx(x, height))
-        cr.stroke()
+        Missing attributes are treated as not set.
+        """
+        return cls(attrs.get("bold", False), attrs.get("fcolor"),
+                   attrs.get("bcolor"), attrs.get("underline", False))
 
-    def set_source_color(self, cr, color_name):
+    def pack(self):
         """
-        Set the source color.
+        Pack the style into an int: bit 0 is bold, bit 1 is underline,  the
+        colors (0 to 99, 127 for None) take 7 bits each from bit 2 and 9 on.
         """
-        cr.set_source_rgba(*self.colors[color_name])
+        fcolor = 127 if self.fcolor is None else self.fcolor
+        bcolor = 127 if self.bcolor is None else self.bcolor
+        return self.bold | self.underline << 1 | fcolor << 2 | bcolor << 9
 
-    def do_button_press_event(self, event):
+    @classmethod
+    @functools.lru_cache(maxsize=4096)
+    def unpack(cls, bits):
         """
-        Start selection.
+        Create a style from an int returned by pack().
+
+        The styles are cached, a line uses only a few of them.
         """
-        subline = self.find_char_at_pos(event.x, event.y)
-        if subline is not None:
-            self.selection_active = True
-            self.selection_start = subline[:2]
-            self.selection_end = None
+        fcolor = bits >> 2 & 127
+        bcolor = bits >> 9 & 127
+        return cls(bool(bits & 1), None if fcolor == 127 else fcolor,
+                   None if bcolor == 127 else bcolor, bool(bits & 2))
+
+
+PLAIN = Style(False, None, None, False)
+
+
+class Run(collections.namedtuple("Run", "start end style")):
+
+    """
+    A sequence of visible characters with the same style.
+
+    start and end are offsets into the tokenized line, so  the  characters
+    of the run are line[start:end].
+    """
+
+    __slots__ = ()
+
+
+@functools.lru_cache(maxsize=4096)
+def tokenize(line, style=PLAIN):
+    """
+    Split a line into runs of visible characters in a single pass.
+
+    The format codes themselves are not part of any run.  style  is  the
+    style that is active at the beginning of the line.
+
+    Returns a tuple of runs, the result is cached per line.
+    """
+    bold, fcolor, bcolor, underline = style
+    runs = []
+    pos = 0
+    for match in FORMAT_RE.finditer(line):
+        start = match.start()
+        if start > pos:
+            runs.append(Run(pos, start, style))
+        code = line[start]
+        if code == FormatType.BOLD:
+            bold = not bold
+        elif code == FormatType.UNDERLINE:
+            underline = not underline
+        elif code == FormatType.RESET:
+            bold = underline = False
+            fcolor = bcolor = None
         else:
-            self.selection_active = False
-            self.selection_start = self.selection_end = None
+            fg, bg = match.groups()
+            fcolor = None if fg is None else int(fg)
+            bcolor = None if bg is None else int(bg)
+        style = Style(bold, fcolor, bcolor, underline)
+        pos = match.end()
+    if pos < len(line):
+        runs.append(Run(pos, len(line), style))
+    return tuple(runs)
 
-    def do_button_release_event(self, event):
+
+def pack_runs(line, start=0):
+    """
+    Parse the runs of line[start:] and pack them into a run table.
+
+    The table is an array of the start offset followed by a (start,  length,
+    style) triple for each run like the runs of tokenize, where the  offsets
+    are offsets into line and style is a packed Style.  The codes are  parsed
+    without creating any Style, so a table is much faster to create than the
+    runs, see find_breaks.
+    """
+    packed = array.array("I", [start])
+    plain = style = PLAIN.pack()
+    pos = start
+    for match in FORMAT_RE.finditer(line, start):
+        code_start = match.start()
+        if code_start > pos:
+            packed.extend((pos, code_start - pos, style))
+        code = line[code_start]
+        if code == FormatType.BOLD:
+            style ^= 1
+        elif code == FormatType.UNDERLINE:
+            style ^= 2
+        elif code == FormatType.RESET:
+            style = plain
+        else:
+            fg, bg = match.groups(127)
+            style = style & 3 | int(fg) << 2 | int(bg) << 9  # see Style.pack
+        pos = match.end()
+    if pos < len(line):
+        packed.extend((pos, len(line) - pos, style))
+    return packed
+
+
+class WidthTable:
+
+    """
+    The advance widths of the characters of a font in pixels.
+
+    The widths are measured once with a Pango layout.  The  widths  of  the
+    ASCII and Latin-1 characters are kept in an array, all others in a dict.
+    """
+
+    def __init__(self, layout, font):
+        self.layout = layout
+        self.font = font
+        if layout is not None:
+            layout.set_font_description(font)
+        self.latin1 = array.array("i", [-1] * 256)
+        self.other = {}
+        self.fallback = 0  # the width of unknown characters if there is no layout
+
+    def copy(self):
         """
-        End selection.
+        Return a copy without a layout.
+
+        The copy only knows the widths that were measured so far, it can  be
+        used in other threads.  Unknown characters get the width of "m".
         """
-        if self.selection_active:
-            self.selection_active = False
-            subline = self.find_char_at_pos(event.x, event.y)
-            if subline is not None:
-                self.selection_end = subline[:2]
+        table = WidthTable(None, self.font)
+        table.latin1 = array.array("i", self.latin1)
+        table.other = dict(self.other)
+        table.fallback = self.char_width("m") if self.layout is not None else self.fallback
+        return table
 
-            if subline is None or self.selection_start == self.selection_end:
-                self.selection_start = self.selection_end = None
-            else:
-                try:
-                    self.clipboard.set_text(self.get_selection(), -1)
-                except IndexError:
-                    pass  # don't set clipboard text if lines out of range are selected
-            self.queue_draw()
+    def measure(self, char):
+        """
+        Measure the width of a character with the layout.
+        """
+        if self.layout is None:
+            return self.fallback
+        self.layout.set_text(char, -1)
+        return self.layout.get_pixel_size()[0]
 
-    def do_motion_notify_event(self, event):
+    def char_width(self, char):
         """
-        Refresh the selection end.
+        Return the width of a character.
         """
-        if self.selection_active:
-            subline = self.find_char_at_pos(event.x, event.y)
-            if subline is not None:
-                self.selection_end = subline[:2]
-            self.queue_draw()
+        code = ord(char)
+        if code < 256:
+            width = self.latin1[code]
+            if width < 0:
+                width = self.latin1[code] = self.measure(char)
+            return width
+        width = self.other.get(char)
+        if width is None:
+            width = self.other[char] = self.measure(char)
+        return width
+
+    def text_width(self, text):
+        """
+        Return the width of a text without format codes.
+        """
+        return sum(map(self.char_width, text))
 
-    def find_char_at_pos(self, x, y):
+    def widths(self, codes):
         """
-        Find the subline number, the character  number  and  the  character
-        itself at the given x/y-coordinates.
+        Return the widths of a NumPy array of code points as an array.
 
-        If there is no character at the coordinates, the character text  is
-        empty and the number is equal to the subline length.
+        Each character that was not measured yet is measured once.
         """
-        left = 0
-        try:
-            subline_no, text = self.find_subline_at_pos(y)
-        except TypeError:
-            return None
-        i = -1
-        while text:
-            i += 1
-            c, text = text[0], text[1:]
-            if c in (FormatType.BOLD, FormatType.RESET, FormatType.UNDERLINE):
-                continue
-            if c == FormatType.COLOR:
-                if len(text) > 0 and text[0] in "0123456789":
-                    if len(text) > 1 and text[1] in "0123456789":
-                        text = text[2:]
-                        i += 2
-                    else:
-                        text = text[1:]
-                        i += 1
-                if len(text) > 1 and text[0] == "," and text[1] in "0123456789":
-                    if len(text) > 2 and text[2] in "0123456789":
-                        text = text[3:]
-                        i += 3
-                    else:
-                        text = text[2:]
-                        i += 2
-                continue
+        widths = numpy.empty(len(codes), numpy.int64)
+        latin1 = codes < 256
+        small = codes[latin1]
+        table = numpy.frombuffer(self.latin1, dtype=numpy.intc)
+        for code in numpy.unique(small[table[small] < 0]).tolist():
+            self.char_width(chr(code))
+        widths[latin1] = table[small]
+        other = codes[~latin1]
+        if len(other):
+            unique, inverse = numpy.unique(other, return_inverse=True)
+            widths[~latin1] = numpy.array([self.char_width(chr(code)) for code in unique.tolist()])[inverse]
+        return widths
+
+
+class FenwickTree(collections.abc.Sequence):
 
-            layout, (width, height) = self.get_pango_layout(c, False)
+    """
+    A list of non-negative integers with prefix sums and searches in
+    logarithmic time.
 
-            if left <= x < left + width:
-                return subline_no, i, c
+    Items can be changed, appended, removed from the front and spliced.
 
-            left += width
-        return subline_no, i + 1, ""
+    Usage:
+    >>> t = FenwickTree([3, 1, 2])
+    >>> t.prefix(2)
+    4
+    >>> t.search(4)
+    2
+    """
 
-    def find_subline_at_pos(self, y):
-        """
-        Find the subline number and subline text at a given y-coordinate.
+    def __init__(self, values=()):
+        self.build(values)
 
-        If there is no subline at the y-coordinate,  the  subline  text  is
-        empty.
+    def build(self, values):
         """
-        subline_no = int(y / self.fontheight)
-        if subline_no < len(self.sublines):
-            return subline_no, self.sublines[subline_no][1]
-        return subline_no, ""
+        Replace all items in linear time.
+        """
+        self.values = array.array("q", values)
+        self.tree = array.array("q", [0])  # 1-based, tree[k] is the sum of the items (k - lowbit(k), k]
+        self.rebuild(0)
+        self.head = 0  # the number of removed items at the front
+        self.removed = 0  # the sum of the removed items
 
-    def get_selection(self):
+    def rebuild(self, start):
         """
-        Return the text between selection start and selection end.
+        Compute the tree nodes after the first start values again  after  the
+        values from start on were replaced.
 
-        If end is smaller than start, start and end are swapped.  The start
-        is included in the selected text, the end is excluded.
+        The nodes of each level are computed at once from the prefix sums of
+        the replaced values, with NumPy if it is installed.  This takes linear
+        time in the number of these values, but without a Python loop.   The
+        nodes up to start do not change.
         """
-        (sl, si), (el, ei) = sorted([self.selection_start, self.selection_end])
-        sublines = self.sublines[sl:el+1]
-        if not sublines:
-            raise IndexError("selection out of range")
-        if len(sublines) == 1:
-            return sublines[0][1][si:ei]
-        # more than one line
-        text = sublines[0][1][si:] + " " * sublines[0][0]["offset"]  # first
-        for subline in sublines[1:-1]:  # middle
-            text += "\n" * subline[0]["first_subline"] + subline[1] + " " * subline[0]["offset"]
-        if el >= len(self.sublines):
-            text += "\n" * sublines[-1][0]["first_subline"] + sublines[-1][1]  # last, full line
+        size = len(self.values)
+        del self.tree[start + 1:]
+        self.tree.extend(array.array("q", bytes(8 * (size - start))))
+        if numpy is not None:
+            tree = numpy.frombuffer(self.tree, numpy.int64)
+            sums = numpy.empty(size - start + 1, numpy.int64)
+            sums[0] = self._prefix(start)
+            numpy.cumsum(numpy.frombuffer(self.values, numpy.int64)[start:], out=sums[1:])
+            sums[1:] += sums[0]
         else:
-            text += "\n" * sublines[-1][0]["first_subline"] + sublines[-1][1][:ei]  # last, end contained
-        return strip_attributes(text)
+            tree = self.tree
+            sums = array.array("q", itertools.accumulate(self.values[start:], initial=self._prefix(start)))
+        # sums[i] is the sum of the first start + i values
+        bit = 1
+        while bit <= size:
+            # the nodes k = bit, 3 * bit, 5 * bit, ... sum the values (k - bit, k]
+            k = start + 1 + (bit - start - 1) % (2 * bit)  # the first one after start
+            if k <= size and k - bit < start:
+                tree[k] = sums[k - start] - self._prefix(k - bit)  # the nodes up to start are complete
+                k += 2 * bit
+            if k <= size:
+                count = (size - k) // (2 * bit) + 1
+                ends, starts = sums[k - start::2 * bit], sums[k - bit - start::2 * bit][:count]
+                tree[k::2 * bit] = ends - starts if numpy is not None else \
+                    array.array("q", map(operator.sub, ends, starts))
+            bit *= 2
+
+    def __len__(self):
+        return len(self.values) - self.head
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("fenwick tree index out of range")
+        return self.values[self.head + index]
+
+    def __setitem__(self, index, value):
+        self[index]  # check index
+        k = self.head + (index % len(self))
+        delta = value - self.values[k]
+        self.values[k] = value
+        k += 1
+        while k < len(self.tree):
+            self.tree[k] += delta
+            k += k & -k
+
+    def _prefix(self, k):
+        total = 0
+        while k:
+            total += self.tree[k]
+            k &= k - 1
+        return total
+
+    def prefix(self, index):
+        """
+        Return the sum of the first index items.
+        """
+        return self._prefix(self.head + index) - self.removed
 
-    def size_allocate_cb(self, rect):
-        self.max_lines = self.get_allocation().height / self.fontheight
+    def search(self, target):
+        """
+        Return the index of the item that contains the target when the items
+        are laid out one after another, that is the smallest index with
+        prefix(index + 1) > target.
 
-        # save selection
-        if self.selection_start is not None:
-            (sl, si), (el, ei) = self.selection_start, self.selection_end
-            sc = si
-            ec = ei
-            for i, line in enumerate(self.sublines):
-                if i < sl:
-                    sc += len(line[1]) + line[0]["offset"]
-                if i < el:
-                    ec += len(line[1]) + line[0]["offset"]
-                elif i >= sl:
-                    break
+        If target is not smaller than the sum of all items, return len(self).
+        """
+        target += self.removed
+        k = 0
+        bit = 1 << (len(self.tree) - 1).bit_length()
+        while bit:
+            if k + bit < len(self.tree) and self.tree[k + bit] <= target:
+                k += bit
+                target -= self.tree[k]
+            bit >>= 1
+        return max(k, self.head) - self.head
+
+    def append(self, value):
+        k = len(self.tree)
+        total = value
+        j = k - 1
+        while j > k - (k & -k):
+            total += self.tree[j]
+            j -= j & -j
+        self.tree.append(total)
+        self.values.append(value)
+
+    def splice(self, index, count, values):
+        """
+        Replace count items from index by values.
 
-        # break lines
-        self.sublines = []
-        for line in self.buffer:
-            self.sublines += list(self.break_line(line, rect.width))
+        This takes logarithmic time per item if the number of items  stays
+        the same.  Otherwise, only the tree nodes from index on are computed
+        again, see rebuild.
+        """
+        values = list(values)
+        if len(values) == count:
+            for i, value in enumerate(values):
+                self[index + i] = value
+            return
+        start = self.head + index
+        self.values[start:start + count] = array.array("q", values)
+        self.rebuild(start)
+
+    def popleft(self, count=1):
+        """
+        Remove the first count items and return their sum.
+        """
+        count = min(count, len(self))
+        removed = sum(self.values[self.head:self.head + count])
+        self.head += count
+        self.removed += removed
+        if self.head > len(self.values) // 2:
+            # compact, the removed part is at least as long as the rest
+            self.build(self.values[self.head:])
+        return removed
 
-        # restore selection
-        if self.selection_start is not None:
-            sl = el = 0
-            for i, line in enumerate(self.sublines):
-                if sc != -1:
-                    if sc < len(line[1]) + line[0]["offset"]:
-                        sl = i
-                        si = sc
-                        sc = -1
-                    else:
-                        sc -= len(line[1]) + line[0]["offset"]
-                if ec != -1:
-                    if ec < len(line[1]) + line[0]["offset"]:
-                        el = i
-                        ei = ec
-                        ec = -1
-                    else:
-                        ec -= len(line[1]) + line[0]["offset"]
-                if sc == ec == -1:
-                    break
-            else:
-                # start or end after last character
-                if sc != -1:
-                    sl = i + 1
-                    si = 0
-                if ec != -1:
-                    el = i + 1
-                    ei = 0
-            self.selection_start, self.selection_end = (sl, si), (el, ei)
 
+def wrap_line(line, max_width, get_width_table):
+    """
+    Break a line into sublines that are not wider than max_width.
 
-class ScrollableXText(Gtk.Box):
-    __gtype_name__ = 'ScrollableXText'
+    get_width_table(bold) returns the width table of the normal or the  bold
+    font.  Yields an (attrs, text) tuple for each subline.
+    """
+    breaks = list(find_breaks(line, max_width, get_width_table))
+    for i, (start, end, style) in enumerate(breaks):
+        offset = breaks[i + 1][0] - end if i + 1 < len(breaks) else 0
+        yield subline_attrs(style, i == 0, offset), line[start:end]
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
 
-        self.adjustment = Gtk.Adjustment(value=0.0,
+def subline_attrs(style, first_subline, offset):
+    """
+    Return the attrs dict of a subline.
+    """
+    attrs = style._asdict()
+    attrs.update(first_subline=first_subline, offset=offset)
+    return attrs
+
+
+def find_breaks(line, max_width, get_width_table, start=0):
+    """
+    Find the sublines of a line like wrap_line, but without copying them.
+
+    Yields a (start, end, style) tuple for each subline,  the  text  of  the
+    subline is line[start:end] and style is active at its start.  Only  the
+    part from start on is wrapped.
+    """
+    table = pack_runs(line, start)
+    style = PLAIN
+    widths = []  # offsets and widths of the visible characters of the current subline
+    left = 0
+    for r in range(1, len(table), 3):
+        run_start, length, bits = table[r:r + 3]
+        char_width = get_width_table(bool(bits & 1)).char_width
+        for i in range(run_start, run_start + length):
+            width = char_width(line[i])
+            left += width
+            widths.append((i, width))
+
+            if left > max_width and len(widths) > 1:
+                # break before the overflowing character or after the
+                # last space within the last 25 characters
+                end, offset, s = i, 0, r
+                for j in range(i, max(start, i - 25), -1):
+                    if line[j] == " ":
+                        end, offset = j, 1
+                        while table[s] > j:
+                            s -= 3
+                        break
+                yield start, end, style
+
+                start = end + offset
+                style = Style.unpack(table[s + 2])
+                k = len(widths)
+                while k and widths[k - 1][0] >= start:
+                    k -= 1
+                del widths[:k]
+                left = sum(width for _, width in widths)
+
+                # the characters after the space can overflow the next subline
+                # too, break before the first one that does
+                while left > max_width and len(widths) > 1:
+                    k, left = 1, widths[0][1]
+                    while left + widths[k][1] <= max_width:
+                        left += widths[k][1]
+                        k += 1
+                    end = widths[k][0]
+                    yield start, end, style
+
+                    start = end
+                    while s + 3 < len(table) and table[s + 3] <= start:
+                        s += 3
+                    style = Style.unpack(table[s + 2])
+                    del widths[:k]
+                    left = sum(width for _, width in widths)
+
+    yield start, len(line), style
+
+
+def find_breaks_batch(lines, max_width, get_width_table):
+    """
+    Find the sublines of many lines at once with NumPy.
+
+    Returns a list of (start, end, style) tuples for each line, the same as
+    find_breaks yields.  The format codes are parsed and the widths of the
+    characters are looked up and summed up in arrays.  Lines that fit are done at once, the  others  are
+    broken one subline per step, all lines in the same step  with  binary
+    searches in the sums.
+    """
+    if not lines:
+        return []
+    text = "\n".join(lines)  # the newlines end the color codes at the end of the lines
+    codes = numpy.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=numpy.int32)
+    size = len(codes)
+    bases = numpy.zeros(len(lines) + 1, numpy.int64)  # the offset of each line, the line ends at the next one - 1
+    numpy.cumsum([len(line) + 1 for line in lines], out=bases[1:])
+
+    # the styles of all characters, the newlines reset them like RESET
+    resets = (codes == ord(FormatType.RESET)) | (codes == ord("\n"))
+    bold_codes = codes == ord(FormatType.BOLD)
+    underline_codes = codes == ord(FormatType.UNDERLINE)
+
+    def toggled(toggles):
+        counts = numpy.cumsum(toggles)
+        return (counts - numpy.maximum.accumulate(numpy.where(resets, counts, 0))) % 2
+
+    bold = toggled(bold_codes)
+    underline = toggled(underline_codes)
+    changes = resets.copy()
+    changes[:1] = True
+    fcolors = numpy.full(size, 127, numpy.int64)
+    bcolors = numpy.full(size, 127, numpy.int64)
+    hidden = numpy.zeros(size + 1, numpy.int8)  # +1 at the start and -1 at the end of the color codes
+    matches = [match.span() + match.groups(127) for match in COLOR_RE.finditer(text)]
+    if matches:
+        starts, ends, fg, bg = (list(column) for column in zip(*matches))
+        changes[starts] = True
+        fcolors[starts] = list(map(int, fg))
+        bcolors[starts] = list(map(int, bg))
+        hidden[starts] += 1
+        hidden[ends] -= 1
+    last_change = numpy.maximum.accumulate(numpy.where(changes, numpy.arange(size), 0))
+    styles = bold | underline << 1 | fcolors[last_change] << 2 | bcolors[last_change] << 9  # see Style.pack
+
+    # the widths of the visible characters
+    visible = ~(resets | bold_codes | underline_codes | (numpy.cumsum(hidden[:-1], dtype=numpy.int8) > 0))
+    positions = numpy.flatnonzero(visible)
+    chars = codes[positions]
+    bold = bold[positions] > 0
+    widths = numpy.empty(len(positions), numpy.int64)
+    for flag in (False, True):
+        widths[bold == flag] = get_width_table(flag).widths(chars[bold == flag])
+    sums = numpy.zeros(len(positions) + 1, numpy.int64)  # sums[k] is the width of the first k characters
+    numpy.cumsum(widths, out=sums[1:])
+    spaces = numpy.concatenate(([-1], numpy.flatnonzero(codes == ord(" "))))
+    firsts = numpy.searchsorted(positions, bases)  # the first visible character of each line
+    overflowing = numpy.flatnonzero(sums[firsts[1:]] - sums[firsts[:-1]] > max_width)
+    result = [[(0, len(line), PLAIN)] for line in lines]
+    if not len(overflowing):
+        return result
+
+    # break the overflowing lines, the sublines are collected as (line, start, end, style) arrays
+    found = []
+    active = overflowing
+    start = bases[active]
+    style = numpy.full(len(active), PLAIN.pack())
+    while len(active):
+        # find the first character that overflows the subline after the last one,
+        # each subline keeps at least its first visible character
+        first = numpy.searchsorted(positions, start)
+        k = numpy.maximum(numpy.searchsorted(sums, sums[first] + max_width, "right") - 1, first + 1)
+        last = k >= firsts[active + 1]
+        found.append((active[last], start[last], bases[active[last] + 1] - 1, style[last]))
+        more = ~last
+        active, start, style, k = active[more], start[more], style[more], k[more]
+
+        # break before it or after the last space within the last 25 characters
+        i = positions[k]
+        space = spaces[numpy.searchsorted(spaces, i, "right") - 1]
+        after_space = space > numpy.maximum(start, i - 25)
+        end = numpy.where(after_space, space, i)
+        found.append((active, start, end, style))
+        start = end + after_space
+        style = styles[end]
+
+    unpacked = {}
+    for n in overflowing.tolist():
+        result[n] = []
+    line_nos, starts, ends, styles = (numpy.concatenate(column) for column in zip(*found))
+    order = numpy.lexsort((starts, line_nos))
+    line_nos, starts, ends, styles = line_nos[order], starts[order], ends[order], styles[order]
+    for n, subline_start, subline_end, bits in zip(line_nos.tolist(), (starts - bases[line_nos]).tolist(),
+                                                   (ends - bases[line_nos]).tolist(), styles.tolist()):
+        style = unpacked.get(bits)
+        if style is None:
+            style = unpacked[bits] = Style.unpack(bits)
+        result[n].append((subline_start, subline_end, style))
+    return result
+
+
+def message_start(line):
+    """
+    Return the offset of the message in a line with a nick column.
+
+    The nick is separated from the message by the first tab, lines without a
+    tab have no nick.
+    """
+    return line.find("\t") + 1
+
+
+def find_message_breaks(line, max_width, get_width_table):
+    """
+    Find the sublines of the message of a line with a nick column, see
+    find_breaks.
+
+    Only the message is wrapped, the nick and the tab are not part of  any
+    subline.
+    """
+    return find_breaks(line, max_width, get_width_table, message_start(line))
+
+
+class Sublines(collections.abc.Sequence):
+
+    """
+    The sublines of the buffer lines.
+
+    The sublines can be indexed like a list of (attrs, text) tuples, but they
+    are stored per buffer line as a packed array of  (start,  end,  style)
+    triples:  the text of a subline is buffer[line_no][start:end] and  style
+    is a packed Style.  The attrs and the text are only created when a subline
+    is accessed.  wrap(line, width) yields the (start, end, style) tuples  of
+    a line, see find_breaks.
+
+    If estimate is given, the lines are wrapped lazily when  their  sublines
+    are accessed.  Until then, a line of length characters counts as
+    estimate(length, width) sublines, so the length of  the  sequence  is
+    refined while lines are wrapped.  Each
+    time an estimate is corrected, changed(subline_no, delta) is called:  all
+    sublines from subline_no on were moved by delta.
+    """
+
+    def __init__(self, buffer, width, wrap, estimate=None, changed=None):
+        self.buffer = buffer
+        self.width = width
+        self.wrap = wrap
+        self.estimate = estimate
+        self.changed = changed
+        self.lines = RingBuffer()  # the packed sublines of each buffer line, None if not wrapped yet
+        self.counts = FenwickTree()  # the (estimated) number of sublines of each buffer line
+        self.total = 0
+
+    def __len__(self):
+        return self.total
+
+    def __eq__(self, other):
+        if not isinstance(other, collections.abc.Sequence):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            sublines = []
+            for i in range(*index.indices(self.total)):
+                if i >= self.total:
+                    break  # the estimate was too high
+                sublines.append(self[i])
+            return sublines
+
+        if index < 0:
+            index += self.total
+        while 0 <= index < self.total:
+            line_no, first = self.locate(index)
+            packed = self.get_packed(line_no)
+            if index < first + len(packed) // 3:
+                return self.unpack(line_no, packed, index - first)
+            # the line has less sublines than estimated, look again
+        raise IndexError("subline index out of range")
+
+    def pack(self, line, breaks=None):
+        """
+        Wrap a line and return its packed sublines.
+
+        breaks are the (start, end, style) tuples of the line if  it  was
+        wrapped already.
+        """
+        packed = array.array("I")
+        for start, end, style in self.wrap(line, self.width) if breaks is None else breaks:
+            packed.extend((start, end, style.pack()))
+        return packed
+
+    def unpack(self, line_no, packed, i):
+        """
+        Return the attrs and the text of the i-th subline of a buffer line.
+        """
+        start, end, style = packed[3 * i:3 * i + 3]
+        offset = packed[3 * i + 3] - end if 3 * i + 3 < len(packed) else 0
+        return subline_attrs(Style.unpack(style), i == 0, offset), self.buffer[line_no][start:end]
+
+    def add_line(self, line):
+        """
+        Add the sublines of a new buffer line.
+        """
+        if self.estimate is None:
+            packed = self.pack(line)
+            count = len(packed) // 3
+            self.lines.append(packed)
+            self.counts.append(count)
+            self.total += count
+        else:
+            self.add_estimated(len(line))
+
+    def extend_wrapped(self, lines, breaks):
+        """
+        Add the sublines of new buffer lines that were wrapped already, see
+        find_breaks_batch.  breaks are the (start, end, style) tuples of
+        each line.
+
+        The counts are rebuilt at once like in extend_estimated.
+        """
+        packed = [self.pack(line, line_breaks) for line, line_breaks in zip(lines, breaks)]
+        counts = [len(sublines) // 3 for sublines in packed]
+        self.lines.extend(packed)
+        self.counts.build(itertools.chain(self.counts, counts))
+        self.total += sum(counts)
+
+    def add_estimated(self, length):
+        """
+        Add a buffer line of the given length that is wrapped when  it  is
+        accessed.
+        """
+        count = self.estimate(length, self.width)
+        self.lines.append(None)
+        self.counts.append(count)
+        self.total += count
+
+    def extend_estimated(self, lengths):
+        """
+        Add buffer lines of the given lengths that are wrapped when they are
+        accessed.
+
+        The counts are rebuilt at once and each length is estimated  once,
+        which is much faster than adding the lines one by one.
+        """
+        lengths = list(lengths)
+        estimates = {length: self.estimate(length, self.width) for length in set(lengths)}
+        counts = list(map(estimates.__getitem__, lengths))
+        self.lines.extend([None] * len(counts))
+        self.counts.build(itertools.chain(self.counts, counts))
+        self.total += sum(counts)
+
+    def splice(self, line_no, count, lines):
+        """
+        Replace the sublines of count buffer lines from line_no by the
+        sublines of lines, which replaced them in the buffer.
+
+        Returns the index of the first replaced subline and the numbers  of
+        removed and added sublines.
+        """
+        first = self.first_subline(line_no)
+        removed = self.counts.prefix(line_no + count) - first
+        if self.estimate is None:
+            packed = [self.pack(line) for line in lines]
+            counts = [len(sublines) // 3 for sublines in packed]
+        else:
+            packed = [None] * len(lines)
+            counts = [self.estimate(len(line), self.width) for line in lines]
+        self.lines[line_no:line_no + count] = packed
+        self.counts.splice(line_no, count, counts)
+        added = sum(counts)
+        self.total += added - removed
+        return first, removed, added
+
+    def rewrap_lines(self, width, line_no, rows):
+        """
+        Wrap the buffer lines from line_no for a new width until they  fill
+        rows sublines.
+
+        The other lines keep their sublines for the old width until they are
+        wrapped again, so this is only meant for the displayed lines.
+        """
+        self.width = width
+        while rows > 0 and line_no < len(self.lines):
+            self.lines[line_no] = None
+            rows -= len(self.get_packed(line_no)) // 3
+            line_no += 1
+
+    def evict(self, count):
+        """
+        Remove the sublines of the first count buffer lines and return  the
+        number of removed sublines.
+        """
+        self.lines.popleft(count)
+        removed = self.counts.popleft(count)
+        self.total -= removed
+        return removed
+
+    def get_packed(self, line_no):
+        """
+        Return the packed sublines of a buffer line and wrap it if necessary.
+        """
+        packed = self.lines[line_no]
+        if packed is None:
+            packed = self.lines[line_no] = self.pack(self.buffer[line_no])
+            count = self.counts[line_no]
+            new_count = len(packed) // 3
+            self.counts[line_no] = new_count
+            self.total += new_count - count
+            if new_count != count and self.changed is not None:
+                self.changed(self.counts.prefix(line_no) + count, new_count - count)
+        return packed
+
+    def get_line(self, line_no):
+        """
+        Return the sublines of a buffer line as (attrs, text) tuples and wrap
+        it if necessary.
+        """
+        packed = self.get_packed(line_no)
+        return [self.unpack(line_no, packed, i) for i in range(len(packed) // 3)]
+
+    def span(self, index):
+        """
+        Return the buffer line of a subline and the start and end offset  of
+        its text in the buffer line.
+        """
+        if index < 0:
+            index += self.total
+        while 0 <= index < self.total:
+            line_no, first = self.locate(index)
+            packed = self.get_packed(line_no)
+            i = 3 * (index - first)
+            if i < len(packed):
+                return line_no, packed[i], packed[i + 1]
+            # the line has less sublines than estimated, look again
+        raise IndexError("subline index out of range")
+
+    def locate(self, index):
+        """
+        Return the buffer line that contains the subline with the given index
+        and the index of the first subline of this buffer line.
+        """
+        line_no = min(self.counts.search(index), len(self.counts) - 1)
+        return line_no, self.counts.prefix(line_no)
+
+    def first_subline(self, line_no):
+        """
+        Return the index of the first subline of a buffer line.
+        """
+        return self.counts.prefix(line_no)
+
+    def to_line_pos(self, subline_no, char):
+        """
+        Convert a subline position into a buffer line position.
+
+        Positions after the last subline are converted to (len(buffer), 0).
+        """
+        if subline_no >= self.total:
+            return len(self.lines), 0
+        self[subline_no]  # wrap the line
+        line_no, first = self.locate(subline_no)
+        return line_no, self.lines[line_no][3 * (subline_no - first)] + char
+
+    def from_line_positions(self, positions):
+        """
+        Convert buffer line positions into subline positions, see
+        from_line_pos.
+
+        The lines of all positions are wrapped first, so wrapping the line of
+        one position cannot move the sublines another one was converted to.
+        """
+        for line_no, char in positions:
+            if line_no < len(self.lines):
+                self.get_packed(line_no)
+        return [self.from_line_pos(*pos) for pos in positions]
+
+    def from_line_pos(self, line_no, char):
+        """
+        Convert a buffer line position into a subline position.
+
+        The position after the last character of a line is  converted  to
+        the start of the next subline.
+        """
+        if line_no >= len(self.lines):
+            return self.total, 0
+        first = self.first_subline(line_no)
+        packed = self.get_packed(line_no)
+        count = len(packed) // 3
+        for i in range(count):
+            # a subline ends where the next one starts, the last one at its end
+            end = packed[3 * i + 3] if i + 1 < count else packed[3 * i + 1]
+            if char < end:
+                return first + i, char - packed[3 * i]
+        return first + count, 0
+
+
+class SearchMatch(collections.namedtuple("SearchMatch", "line_no start end")):
+
+    """
+    A search match in a buffer line.
+
+    start and end are offsets into the line with its format codes, so the
+    match is line[start:end] like a selection.
+    """
+
+    __slots__ = ()
+
+
+def visible_offsets(line):
+    """
+    Return the offsets of the characters of strip_attributes(line) in line.
+    """
+    offsets = array.array("I")
+    for run in tokenize(line):
+        offsets.extend(range(run.start, run.end))
+    return offsets
+
+
+class Link(collections.namedtuple("Link", "start end kind target")):
+
+    """
+    A URL, channel or nick in a buffer line.
+
+    start and end are offsets into the line with its format codes, kind is
+    "url", "channel" or "nick" and target is the visible text of the link.
+    """
+
+    __slots__ = ()
+
+
+# URLs, channels at the start of a word and the nick in "<nick> message"
+LINK_RE = re.compile(r"""
+    (?P<url>(?:(?:https?|ftp)://|www\.)[^\s<>"\x00-\x1f]+)
+    | (?<![^\s(])(?P<channel>[#&][^\s,\x00-\x1f]+)
+    | ^<[~&@%+]?(?P<nick>[^\s>]+)>
+""", re.VERBOSE)
+WORD_RE = re.compile(r"[^\s,.:;!?<>()\"']+")
+
+
+def find_links(line, nicks=()):
+    """
+    Find the links in a line and return them as a tuple of Link tuples that
+    is sorted by start.
+
+    Words that are in nicks are nicks, too.
+    """
+    text = strip_attributes(line)
+    spans = []
+    for match in LINK_RE.finditer(text):
+        kind = match.lastgroup
+        start, end = match.span(kind)
+        target = match.group(kind)
+        if kind != "nick":
+            # punctuation after a link most likely ends a sentence
+            stripped = target.rstrip(".,:;!?'\"")
+            if stripped.endswith(")") and "(" not in stripped:
+                stripped = stripped[:-1]
+            end -= len(target) - len(stripped)
+            target = stripped
+        spans.append((start, end, kind, target))
+    if nicks:
+        taken = [(start, end) for start, end, kind, target in spans]
+        for match in WORD_RE.finditer(text):
+            if match.group() in nicks and not any(s < match.end() and match.start() < e for s, e in taken):
+                spans.append((match.start(), match.end(), "nick", match.group()))
+        spans.sort()
+    if not spans:
+        return ()
+    if len(text) == len(line):
+        return tuple(Link(*span) for span in spans)
+    offsets = visible_offsets(line)
+    return tuple(Link(offsets[start], offsets[end - 1] + 1, kind, target) for start, end, kind, target in spans)
+
+
+def regex_literals(pattern):
+    """
+    Return strings that every match of a regular expression contains.
+
+    Only literals that are easy to find are returned:  nothing for patterns
+    with alternatives or special groups, and no characters that are optional
+    or escaped.  The result may be empty.
+    """
+    if "|" in pattern or "(?" in pattern.replace("(?:", "") or \
+       re.compile(pattern).flags & re.VERBOSE:
+        return []
+    literals = []
+    groups = []  # the number of literals at the start of each open group
+    current = ""
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        i += 1
+        if c.isalnum() or c in " _-":
+            current += c
+            continue
+        if c in "?*{":
+            current = current[:-1]  # the last character is optional
+        if current:
+            literals.append(current)
+            current = ""
+        if c == "\\":
+            i += 1
+        elif c == "[":
+            i = pattern.find("]", i + 1 + pattern.startswith("^", i)) + 1 or len(pattern)
+        elif c == "{":
+            i = pattern.find("}", i) + 1 or len(pattern)
+        elif c == "(":
+            groups.append(len(literals))
+        elif c == ")" and groups:
+            start = groups.pop()
+            if pattern[i:i + 1] in ("?", "*", "{"):
+                del literals[start:]  # the group is optional
+    if current:
+        literals.append(current)
+    return literals
+
+
+class SearchIndex:
+
+    """
+    A trigram index of the lowercase visible text of the buffer lines.
+
+    The lines get consecutive ids.  The index maps each trigram to the blocks
+    of about block_size lines that contain it, so a search only has to  check
+    the lines of the blocks that contain all trigrams of the searched text.
+    Lines are evicted from the front by moving first, the postings are
+    compacted when more lines were evicted than are left.  When lines are
+    inserted or deleted, the blocks after them are moved, see splice.
+    """
+
+    def __init__(self, first=0, block_size=16):
+        self.block_size = block_size
+        self.postings = {}  # trigram -> array of block numbers
+        self.pending = set()  # the trigrams of the last block, added to the postings when it is full
+        self.starts = array.array("Q", [first])  # the id of the first line of each block from block base on
+        self.base = 0  # the number of the first block in starts
+        self.first = first  # the id of the first line
+        self.next = first  # the id of the next line
+        self.compacted = first  # self.first at the last compaction
+
+    def __len__(self):
+        return self.next - self.first
+
+    def block(self, line_id):
+        """
+        Return the number of the block of a line.
+        """
+        return self.base + bisect.bisect_right(self.starts, line_id) - 1
+
+    def add(self, text):
+        """
+        Add the visible text of the next line.
+        """
+        text = text.lower()
+        self.pending.update(text[i:i + 3] for i in range(len(text) - 2))
+        self.next += 1
+        if self.next - self.starts[-1] >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Add the trigrams of the last block to the postings and start a  new
+        block.
+        """
+        block = self.base + len(self.starts) - 1
+        postings = self.postings
+        for trigram in self.pending:
+            try:
+                postings[trigram].append(block)
+            except KeyError:
+                postings[trigram] = array.array("I", [block])
+        self.pending.clear()
+        self.starts.append(self.next)
+
+    def update(self, line_id, text):
+        """
+        Add the visible text of a line that was replaced.
+
+        The trigrams of the old text are kept, so the block of the line may
+        be a candidate that does not match anymore.
+        """
+        text = text.lower()
+        trigrams = {text[i:i + 3] for i in range(len(text) - 2)}
+        block = self.block(line_id)
+        if block == self.base + len(self.starts) - 1:
+            self.pending.update(trigrams)  # not flushed yet
+            return
+        for trigram in trigrams:
+            blocks = self.postings.setdefault(trigram, array.array("I"))
+            i = bisect.bisect_left(blocks, block)
+            if i == len(blocks) or blocks[i] != block:
+                blocks.insert(i, block)
+
+    def splice(self, line_id, count, texts):
+        """
+        Replace count lines from line_id on by lines with the visible texts.
+
+        The blocks after the replaced lines are moved by the difference of the
+        line counts, the blocks of the replaced lines shrink or grow, so the
+        postings stay as they are.  The new lines are added with update.
+        """
+        texts = list(texts)
+        delta = len(texts) - count
+        end = line_id + count
+        i = bisect.bisect_right(self.starts, line_id)
+        self.starts[i:] = array.array("Q", [start + delta if start >= end else min(start, line_id + len(texts))
+                                            for start in self.starts[i:]])
+        self.next += delta
+        for new_id, text in enumerate(texts, line_id):
+            self.update(new_id, text)
+
+    def evict(self, count):
+        """
+        Remove the first count lines.
+        """
+        self.first = min(self.next, self.first + count)
+        if self.first - self.compacted > len(self):
+            dropped = bisect.bisect_right(self.starts, self.first) - 1
+            block = self.base + dropped
+            for trigram, blocks in list(self.postings.items()):
+                del blocks[:bisect.bisect_left(blocks, block)]
+                if not blocks:
+                    del self.postings[trigram]
+            del self.starts[:dropped]
+            self.base = block
+            self.compacted = self.first
+
+    def candidates(self, literals):
+        """
+        Return the ids of the lines that may contain all literals, or None
+        if the literals are too short to use the index.
+        """
+        trigrams = {literal[i:i + 3] for literal in map(str.lower, literals) for i in range(len(literal) - 2)}
+        if not trigrams:
+            return None
+        postings = sorted((self.postings.get(trigram, ()) for trigram in trigrams), key=len)
+        blocks = set(postings[0])
+        for other in postings[1:]:
+            if not blocks:
+                break
+            blocks.intersection_update(other)
+        if self.pending and trigrams <= self.pending:
+            blocks.add(self.base + len(self.starts) - 1)
+        ids = []
+        starts = self.starts
+        for block in sorted(blocks):
+            i = block - self.base
+            end = starts[i + 1] if i + 1 < len(starts) else self.next
+            ids.extend(range(max(starts[i], self.first), min(end, self.next)))
+        return ids
+
+
+class Stats:
+
+    """
+    Counters and timers of the hot paths of an XText.
+
+    Assign a Stats object to XText.stats to enable them,  the  hooks  only
+    check for None otherwise.  Each entry has a count and a total time  in
+    seconds (0 for pure counters):
+
+    - "break_line": lines wrapped in the main loop
+    - "frame": frames drawn by do_draw, "frame_chars": characters rendered
+    - "subline_cache_hit" and "subline_cache_miss": rendered subline lookups
+    - "rewrap" and "background_rewrap": rewraps in size_allocate_cb
+    - "selection_update" and "selection_rows": selection changes while
+      dragging and the rows they redraw
+    - "hit_test": find_char_at_pos calls
+
+    After each frame, callback(stats) is called if it is set.
+
+    Usage:
+    >>> widget.stats = Stats(lambda stats: print(stats.report()))
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.counts = collections.Counter()
+        self.times = collections.Counter()
+        self.last_frame = (0.0, 0)  # the time and the rendered characters of the last frame
+
+    def add(self, name, count=1, seconds=0.0):
+        self.counts[name] += count
+        self.times[name] += seconds
+
+    @contextmanager
+    def timed(self, name):
+        """
+        Count and time the body of a with statement.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, 1, time.perf_counter() - start)
+
+    def frame_done(self, seconds, chars):
+        self.add("frame", 1, seconds)
+        self.add("frame_chars", chars)
+        self.last_frame = seconds, chars
+        if self.callback is not None:
+            self.callback(self)
+
+    def reset(self):
+        self.counts.clear()
+        self.times.clear()
+        self.last_frame = (0.0, 0)
+
+    def hit_rate(self, name):
+        """
+        Return the share of hits of name + "_hit" and name + "_miss".
+        """
+        total = self.counts[name + "_hit"] + self.counts[name + "_miss"]
+        return self.counts[name + "_hit"] / total if total else 0.0
+
+    def snapshot(self):
+        """
+        Return the counts, the times and the cache hit rates as a dict.
+        """
+        tokenize_info = tokenize.cache_info()
+        tokenize_total = tokenize_info.hits + tokenize_info.misses
+        return {
+            "counts": dict(self.counts),
+            "times": dict(self.times),
+            "last_frame": self.last_frame,
+            "subline_cache_hit_rate": self.hit_rate("subline_cache"),
+            "tokenize_cache_hit_rate": tokenize_info.hits / tokenize_total if tokenize_total else 0.0,
+        }
+
+    def report(self):
+        """
+        Return the stats as text, one entry per line.
+        """
+        lines = []
+        for name, count in sorted(self.counts.items()):
+            seconds = self.times[name]
+            if seconds:
+                lines.append("%-20s %10d %12.3f ms %10.1f us/call" % (name, count, seconds * 1000,
+                                                                    seconds / count * 1e6))
+            else:
+                lines.append("%-20s %10d" % (name, count))
+        lines.append("%-20s %10.1f %%" % ("subline cache hits", self.hit_rate("subline_cache") * 100))
+        return "\n".join(lines)
+
+
+class Renderer:
+
+    """
+    Wrap and draw lines with format codes on any cairo surface.
+
+    A renderer holds the fonts, the colors and the width tables of the fonts,
+    so it needs no Gtk widget or display.  XText is a renderer, too.  To
+    render many snapshots, reuse one renderer: the widths of the characters
+    are measured only once.
+
+    Usage:
+    >>> renderer = Renderer()
+    >>> renderer.render_pages(["hello", "world"], 800, 600, "log-%d.png")
+    ['log-1.png']
+    """
+
+    def __init__(self):
+        self.colors = {
+            "background":           color(0xf0f0, 0xf0f0, 0xf0f0),
+            "foreground":           color(0x2512, 0x29e8, 0x2b85),
+            "mark_backg":           color(0x2020, 0x4a4a, 0x8787),
+            "mark_foreg":           color(0xd3d3, 0xd7d7, 0xcfcf),
+            "light_sep":            color(0xffff, 0xffff, 0xffff),
+            "dark_sep":             color(0x1111, 0x1111, 0x1111),
+            "thin_sep":             color(0x8e38, 0x8e38, 0x9f38),
+            "text":                 color(0x0000, 0x0000, 0x0000),
+            "match_backg":          color(0xfcfc, 0xe9e9, 0x4f4f),
+            "current_match_backg":  color(0xf5f5, 0x7979, 0x0000),
+            ColorCode.WHITE:        color(0xd3d3, 0xd7d7, 0xcfcf),
+            ColorCode.BLACK:        color(0x2e2e, 0x3434, 0x3636),
+            ColorCode.BLUE:         color(0x3434, 0x6565, 0xa4a4),
+            ColorCode.GREEN:        color(0x4e4e, 0x9a9a, 0x0606),
+            ColorCode.RED:          color(0xcccc, 0x0000, 0x0000),
+            ColorCode.LIGHT_RED:    color(0x8f8f, 0x3939, 0x0202),
+            ColorCode.PURPLE:       color(0x5c5c, 0x3535, 0x6666),
+            ColorCode.ORANGE:       color(0xcece, 0x5c5c, 0x0000),
+            ColorCode.YELLOW:       color(0xc4c4, 0xa0a0, 0x0000),
+            ColorCode.LIGHT_GREEN:  color(0x7373, 0xd2d2, 0x1616),
+            ColorCode.AQUA:         color(0x1111, 0xa8a8, 0x7979),
+            ColorCode.LIGHT_AQUA:   color(0x5858, 0xa1a1, 0x9d9d),
+            ColorCode.LIGHT_BLUE:   color(0x5757, 0x7979, 0x9e9e),
+            ColorCode.LIGHT_PURPLE: color(0xa0d0, 0x42d4, 0x6562),
+            ColorCode.GREY:         color(0x5555, 0x5757, 0x5353),
+            ColorCode.LIGHT_GREY:   color(0x8888, 0x8a8a, 0x8585),
+        }
+
+        self.fonts = {
+            "normal": "Monospace 9",
+            "bold": "Monospace Bold 9",
+        }
+        for font in self.fonts:
+            self.fonts[font] = Pango.font_description_from_string(self.fonts[font])
+        self.update_font_metrics()
+        self.run_layout = self.create_pango_layout("")  # reused to draw runs of characters
+
+    @property
+    def colors(self):
+        """
+        The palette, a dict that maps names to rgba tuples, see set_color.
+
+        Changing it in place or replacing it changes palette_version.
+        """
+        return self._colors
+
+    @colors.setter
+    def colors(self, colors):
+        self._colors = VersionedDict(colors)
+
+    @property
+    def fonts(self):
+        """
+        The "normal" and the "bold" font description, see set_font.
+
+        Changing it in place or replacing it changes font_version.
+        """
+        return self._fonts
+
+    @fonts.setter
+    def fonts(self, fonts):
+        self._fonts = VersionedDict(fonts)
+
+    @property
+    def palette_version(self):
+        """
+        A number that changes when the colors change, used in cache keys.
+        """
+        return self._colors.version
+
+    @property
+    def font_version(self):
+        """
+        A number that changes when the fonts change, used in cache keys.
+        """
+        return self._fonts.version
+
+    def create_pango_context(self):
+        """
+        Return a Pango context for cairo, XText uses the one of the widget.
+        """
+        return PangoCairo.font_map_get_default().create_context()
+
+    def create_pango_layout(self, text):
+        """
+        Return a Pango layout with the given text.
+        """
+        layout = Pango.Layout.new(self.create_pango_context())
+        layout.set_text(text, -1)
+        return layout
+
+    def update_font_metrics(self):
+        """
+        Update the font ascent and height from the normal font.
+        """
+        pcx = self.create_pango_context()
+        metrics = pcx.get_metrics(self.fonts["normal"])
+        self.ascent = metrics.get_ascent() // Pango.SCALE
+        self.fontheight = (metrics.get_ascent() + metrics.get_descent()) // Pango.SCALE
+        self.char_width = max(1, metrics.get_approximate_char_width() // Pango.SCALE)
+        self.width_tables = {}
+
+    def set_font(self, name, font):
+        """
+        Set the "normal" or "bold" font.
+
+        font is a font description or a string like "Monospace 9".
+        """
+        if isinstance(font, str):
+            font = Pango.font_description_from_string(font)
+        self.fonts[name] = font
+        self.update_font_metrics()
+
+    def set_color(self, name, rgba):
+        """
+        Set a color of the palette.
+
+        name is one of the names in self.colors (like "background" or  a
+        ColorCode), rgba is a tuple of 3 or 4 floats in 0.0 .. 1.0.
+        """
+        self.colors[name] = rgba
+
+    def get_width_table(self, bold):
+        """
+        Return the width table of the normal or the bold font.
+
+        The tables are created again if the fonts were replaced.
+        """
+        font = self.fonts["bold" if bold else "normal"]
+        table = self.width_tables.get(bold)
+        if table is None or table.font is not font:
+            table = self.width_tables[bold] = WidthTable(self.create_pango_layout(""), font)
+        return table
+
+    def break_line(self, line, max_width):
+        """
+        Break a line into sublines if it is longer than max_width.
+        """
+        return wrap_line(line, max_width, self.get_width_table)
+
+    def find_breaks(self, line, max_width):
+        """
+        Find the sublines of a line without copying them, see
+        find_breaks().
+        """
+        return find_breaks(line, max_width, self.get_width_table)
+
+    def wrap_lines(self, lines, width):
+        """
+        Break lines into sublines and return them as a list of (attrs, text)
+        tuples.
+        """
+        return [subline for line in lines for subline in self.break_line(line, width)]
+
+    def draw_subline(self, cr, attrs, text, top=0, selection=(0, 0), highlights=(), hover=(0, 0), left=0):
+        """
+        Draw a subline.
+
+        selection and hover are the (start, end) offsets of the selected and
+        the hovered part, highlights are the (start, end, current) offsets of
+        the search matches.  Consecutive characters with the same attributes
+        are drawn at once.
+        """
+        sel_start, sel_end = selection
+        hover_start, hover_end = hover
+        offsets = {sel_start, sel_end, hover_start, hover_end}.union(
+            *((start, end) for start, end, current in highlights))
+
+        for run in tokenize(text, Style.from_attrs(attrs)):
+            # split the run at the selection, highlight and hover bounds
+            bounds = [run.start, run.end]
+            bounds[1:1] = sorted(offset for offset in offsets if run.start < offset < run.end)
+            for start, end in zip(bounds, bounds[1:]):
+                selected = sel_start <= start < sel_end
+                highlight = None
+                for h_start, h_end, current in highlights:
+                    if h_start <= start < h_end:
+                        highlight = "current_match" if current else "match"
+                style = run.style._replace(underline=True) if hover_start <= start < hover_end else run.style
+                left += self.draw_run(cr, text[start:end], style, selected, left, top, highlight)
+
+    def draw_run(self, cr, text, style, selected, left, top, highlight=None):
+        """
+        Draw characters with the same style and return their width.
+
+        highlight is None, "match" or "current_match" for search matches.
+        """
+        bold, fcolor, bcolor, underline = style
+        width = self.get_width_table(bold).text_width(text)
+        layout = self.run_layout
+        layout.set_font_description(self.fonts["bold" if bold else "normal"])
+        layout.set_text(text, -1)
+        height = layout.get_pixel_size()[1]
+
+        # draw background
+        cr.rectangle(left, top, width, height)
+        if selected:
+            self.set_source_color(cr, "mark_backg")
+        elif highlight is not None:
+            self.set_source_color(cr, highlight + "_backg")
+        elif bcolor is None:
+            self.set_source_color(cr, "background")
+        else:
+            self.set_source_color(cr, bcolor % 16)
+        cr.fill()
+
+        # draw characters
+        if selected:
+            self.set_source_color(cr, "mark_foreg")
+        elif fcolor is None:
+            self.set_source_color(cr, "text")
+        else:
+            self.set_source_color(cr, fcolor % 16)
+        cr.move_to(left, top)
+        PangoCairo.show_layout(cr, layout)
+
+        # draw underline
+        if underline:
+            with saved(cr):
+                cr.set_line_width(1)
+                cr.set_line_cap(cairo.LINE_CAP_SQUARE)
+                cr.move_to(*halfpx(left, top + self.ascent + 1))
+                cr.line_to(*halfpx(left + width, top + self.ascent + 1))
+                cr.stroke()
+
+        return width
+
+    def set_source_color(self, cr, color_name):
+        """
+        Set the source color.
+        """
+        cr.set_source_rgba(*self.colors[color_name])
+
+    def draw_sublines(self, cr, sublines, width, top=0):
+        """
+        Draw (attrs, text) sublines below each other on their background.
+        """
+        for attrs, text in sublines:
+            cr.rectangle(0, top, width, self.fontheight)
+            self.set_source_color(cr, "background")
+            cr.fill()
+            self.draw_subline(cr, attrs, text, top)
+            top += self.fontheight
+
+    def render_pages(self, lines, width, height, path, format=None):
+        """
+        Render lines wrapped to width into pages of width x height pixels.
+
+        path is a file name with "%d" for the page number, which starts at
+        1.  format is "png" or "svg", by default it is taken from the file
+        name extension.  Returns the file names of the pages.
+        """
+        if format is None:
+            format = os.path.splitext(path)[1][1:].lower()
+        if format not in ("png", "svg"):
+            raise ValueError("unknown page format: %r" % format)
+        sublines = self.wrap_lines(lines, width)
+        rows = max(1, height // self.fontheight)
+        paths = []
+        for page in range(max(1, -(-len(sublines) // rows))):
+            page_path = path % (page + 1)
+            if format == "svg":
+                surface = cairo.SVGSurface(page_path, width, height)
+            else:
+                surface = cairo.ImageSurface(cairo.FORMAT_RGB24, width, height)
+            cr = cairo.Context(surface)
+            self.set_source_color(cr, "background")
+            cr.paint()
+            self.draw_sublines(cr, sublines[page * rows:(page + 1) * rows], width)
+            if format == "svg":
+                surface.finish()
+            else:
+                surface.write_to_png(page_path)
+            paths.append(page_path)
+        return paths
+
+
+class XText(Gtk.Misc, Renderer):
+    __gtype_name__ = 'XText'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.add_events(Gdk.EventMask.BUTTON_PRESS_MASK |
+                        Gdk.EventMask.BUTTON_RELEASE_MASK |
+                        Gdk.EventMask.POINTER_MOTION_MASK)
+        self.connect("size-allocate", XText.size_allocate_cb)
+
+        # the selected text is offered on the clipboard and created when it is pasted
+        targets = Gtk.TargetList.new([])
+        targets.add_text_targets(0)
+        Gtk.selection_add_targets(self, Gdk.SELECTION_CLIPBOARD, Gtk.target_table_new_from_list(targets))
+        self.connect("selection-get", XText.selection_get_cb)
+        self.connect("selection-clear-event", XText.selection_clear_cb)
+        self.clipboard_selection = None  # (first line id, char, last line id, char) of the copied text
+
+        self.selection_active = False
+        self.selection_start = None
+        self.selection_end = None
+
+        self._buffer = RingBuffer()
+        self.buffer_bytes = 0  # the UTF-8 size of all buffer lines
+        self.scrollback_lines = None  # maximal number of buffer lines, None for no limit
+        self.scrollback_bytes = None  # maximal UTF-8 size of all buffer lines, None for no limit
+        self.indent = False  # show the text before the first tab of a line in a nick column
+        self.buffer_indent = 50  # the x-coordinate of the separator between the nick and the message column
+        self.margin = 2
+        self.nick_widths = {}  # the widths of the nicks, see get_nick_width
+        self.nick_widths_size = 4096  # the cache is cleared when it gets bigger
+        self.separator_drag = False  # True while the separator is dragged
+        self.separator_hover = False  # True while the pointer is over the separator
+        self.sublines = Sublines(self._buffer, None, self.find_breaks)
+        self.wrap_width = None  # the width the sublines are wrapped to, None if not wrapped yet
+        self.wrapped_partly = False  # True if only the displayed lines are wrapped, see move_separator
+        self.lazy_wrap = False  # wrap lines only when they are displayed
+        self.batch_wrap = numpy is not None  # wrap all lines in batches with NumPy, see wrap_batch
+        self.batch_size = 4096  # the number of lines per batch
+        self.lines_evicted = 0  # the number of lines evicted from the buffer so far
+
+        # rewraps of big buffers in a thread, see start_rewrap
+        self.background_rewrap_lines = 10000  # rewrap buffers with more lines in a thread, None to disable
+        self.rewrap_generation = 0  # incremented to cancel a running rewrap
+        self.rewrap_width = None  # the width of the running rewrap
+        self.rewrap_thread = None
+
+        # lines pushed from any thread, see push_lines
+        self.pending_lines = collections.deque()
+        self.pending_lock = threading.Lock()
+        self.pending_source = None  # the idle source that appends the pending lines
+        self.pending_listeners = []  # called in the main loop after the pending lines were appended
+
+        # links, see find_links
+        self.line_links = RingBuffer()  # the links of each buffer line, None if not detected yet
+        self.nicks = set()  # words that are detected as nicks in new lines
+        self.link_handler = None  # called with the buffer line number and the Link when a link is clicked
+        self.hover_link = None  # (line id, start, end) of the link under the pointer
+
+        # search, see search
+        self.search_index = None  # built on the first search, then kept up to date
+        self.search_regex = None  # the compiled pattern of the current search
+        self.search_literals = []  # the texts that every match contains
+        self.search_matches = []  # (line id, start, end) of the matches, line ids count evicted lines too
+        self.search_current = None  # the index of the current match
+
+        self.start_subline = 0  # the first displayed subline
+        self.scroll_handler = None  # called with a subline number and an offset to scroll instead, see scroll_to_subline
+        self.start_offset = 0  # the offset of the first subline
+        self.max_lines = 0.0  # maximal number of lines that fit into the widget height (float)
+
+        Renderer.__init__(self)
+        self.stats = None  # a Stats object to instrument the hot paths, see Stats
+
+        # rendered sublines, see get_subline_surface
+        self.subline_cache = collections.OrderedDict()
+        self.subline_cache_size = 256  # 0 disables the cache
+        self.subline_cache_bytes = 16 * 2 ** 20  # about two screens of full width rows on a full HD display
+        self.subline_cache_used = 0  # the pixel data of the cached surfaces in bytes
+
+        # the last rendered frame, see render_frame
+        self.frame = None
+        self.back_frame = None
+        self.frame_key = None
+        self.frame_position = 0  # the y-coordinate of the frame top in the sublines
+        self.frame_rows = {}  # the row keys of the sublines in the frame
+        self.frame_chars = 0  # the number of characters rendered into the frame
+
+    def set_font(self, name, font):
+        """
+        Set the "normal" or "bold" font and rewrap the buffer.
+
+        font is a font description or a string like "Monospace 9".
+        """
+        super().set_font(name, font)
+        self.clear_subline_cache()
+        self.nick_widths.clear()
+        self.redraw()
+
+    def set_color(self, name, rgba):
+        """
+        Set a color of the palette and queue a redraw.
+
+        name is one of the names in self.colors (like "background" or  a
+        ColorCode), rgba is a tuple of 3 or 4 floats in 0.0 .. 1.0.
+        """
+        super().set_color(name, rgba)
+        self.clear_subline_cache()
+        self.queue_draw()
+
+    def find_breaks(self, line, max_width):
+        """
+        Find the sublines of a buffer line without copying them, see
+        find_breaks().  With indent, only the message is wrapped, see
+        find_message_breaks().
+        """
+        if self.indent:
+            breaks = find_message_breaks(line, max_width, self.get_width_table)
+        else:
+            breaks = find_breaks(line, max_width, self.get_width_table)
+        if self.stats is None:
+            return breaks
+        with self.stats.timed("break_line"):
+            return list(breaks)
+
+    @property
+    def buffer(self):
+        """
+        The buffer lines.
+
+        Assigning a list of lines copies them into a new ring  buffer  and
+        rewraps all lines on the next allocation.  A FileBuffer is used as it
+        is and always wrapped lazily.  If the buffer is modified  in  place,
+        call redraw() afterwards.
+        """
+        return self._buffer
+
+    @buffer.setter
+    def buffer(self, lines):
+        self._buffer = lines if isinstance(lines, FileBuffer) else RingBuffer(lines)
+        self.buffer_bytes = self.count_buffer_bytes()
+        self.sublines = Sublines(self._buffer, None, self.find_breaks)  # the old ones point into the old buffer
+        self.clipboard_selection = None  # the copied lines are gone
+        self.detect_links()
+        self.wrap_width = None
+        self.cancel_rewrap()
+        self.reset_search_index()
+        self.trim_scrollback()
+
+    def redraw(self):
+        """
+        Rewrap all buffer lines and queue a redraw.
+        """
+        self.wrap_width = None
+        self.buffer_bytes = self.count_buffer_bytes()
+        self.detect_links()
+        self.reset_search_index()
+        self.trim_scrollback()
+        self.size_allocate_cb(self.get_allocation())
+        self.queue_draw()
+
+    def detect_links(self):
+        """
+        Forget the links of all buffer lines.
+
+        They are found when they are needed, see get_links, so assigning  a
+        big buffer does not scan all of its lines.  The links of lines that
+        are added later are found when they are added.
+        """
+        self.line_links = RingBuffer(itertools.repeat(None, len(self.buffer)))
+        self.hover_link = None
+
+    def get_links(self, line_no):
+        """
+        Return the links of a buffer line.
+        """
+        links = self.line_links[line_no]
+        if links is None:
+            links = self.line_links[line_no] = find_links(self.buffer[line_no], self.nicks)
+        return links
+
+    def count_buffer_bytes(self):
+        """
+        Return the UTF-8 size of all buffer lines.
+        """
+        if isinstance(self.buffer, FileBuffer):
+            return self.buffer.nbytes
+        return sum(len(line.encode()) for line in self.buffer)
+
+    def wraps_lazily(self):
+        """
+        Return whether the buffer lines are only wrapped when displayed.
+        """
+        return self.lazy_wrap or isinstance(self.buffer, FileBuffer)
+
+    def append_line(self, line):
+        """
+        Append a line to the buffer and queue a redraw.
+
+        Only the new line is wrapped, the existing sublines are kept.
+        """
+        self.append_lines([line])
+
+    def append_lines(self, lines):
+        """
+        Append some lines to the buffer and queue a redraw.
+
+        Only the new lines are wrapped, the existing sublines are kept.
+        """
+        for line in lines:
+            self.buffer.append(line)
+            self.buffer_bytes += len(line.encode())
+            self.line_links.append(find_links(line, self.nicks))
+            if self.wrap_width is not None:
+                self.sublines.add_line(line)
+            if self.search_index is not None:
+                self.search_index.add(strip_attributes(line))
+            if self.search_regex is not None:
+                line_id = self.lines_evicted + len(self.buffer) - 1
+                self.search_matches.extend(self.match_line(line_id, line))
+        self.trim_scrollback()
+        self.queue_draw()
+
+    def replace_line(self, line_no, line):
+        """
+        Replace a buffer line, see replace_lines.
+        """
+        self.replace_lines(line_no, 1, [line])
+
+    def insert_lines(self, line_no, lines):
+        """
+        Insert lines in front of a buffer line, see replace_lines.
+        """
+        self.replace_lines(line_no, 0, lines)
+
+    def delete_lines(self, line_no, count=1):
+        """
+        Delete count buffer lines from line_no on, see replace_lines.
+        """
+        self.replace_lines(line_no, count, [])
+
+    def replace_lines(self, line_no, count, lines):
+        """
+        Replace count buffer lines from line_no on by some lines.
+
+        Only the new lines are wrapped and their sublines are spliced  into
+        the existing ones.  The display, the selection, the links, the search
+        matches and the copied text are moved accordingly and only the
+        displayed rows that changed are redrawn.  The lines of a FileBuffer cannot be replaced.
+        """
+        if isinstance(self.buffer, FileBuffer):
+            raise TypeError("the lines of a FileBuffer cannot be replaced")
+        if not 0 <= line_no <= line_no + count <= len(self.buffer):
+            raise IndexError("buffer lines out of range")
+        lines = list(lines)
+        self.buffer_bytes += sum(len(line.encode()) for line in lines) - \
+            sum(len(line.encode()) for line in self.buffer[line_no:line_no + count])
+        self.buffer[line_no:line_no + count] = lines
+        self.line_links[line_no:line_no + count] = [find_links(line, self.nicks) for line in lines]
+        self.replace_search_lines(line_no, count, lines)
+        if self.hover_link is not None and self.hover_link[0] >= self.lines_evicted + line_no:
+            self.set_hover_link(None)
+        if self.clipboard_selection is not None:
+            start_id, sc, end_id, ec = self.clipboard_selection
+            if self.lines_evicted + line_no + count <= start_id:
+                delta = len(lines) - count
+                self.clipboard_selection = start_id + delta, sc, end_id + delta, ec
+            elif self.lines_evicted + line_no <= end_id:
+                self.clipboard_selection = None  # the copied lines were replaced
+
+        if self.rewrap_width is not None:
+            self.start_rewrap(self.rewrap_width)  # the running one wraps the old lines
+        if self.wrap_width is not None:
+            self.move_sublines(*self.sublines.splice(line_no, count, lines))
+        self.trim_scrollback()
+
+    def replace_search_lines(self, line_no, count, lines):
+        """
+        Update the search index and the search matches after  count  buffer
+        lines from line_no on were replaced by lines.
+
+        The ids of the lines after them move by the difference of the line
+        counts, in the index too, see SearchIndex.splice.
+        """
+        first_id = self.lines_evicted + line_no
+        delta = len(lines) - count
+        if self.search_index is not None:
+            self.search_index.splice(first_id, count, map(strip_attributes, lines))
+        if self.search_regex is None:
+            return
+        start = bisect.bisect_left(self.search_matches, (first_id,))
+        end = bisect.bisect_left(self.search_matches, (first_id + count,))
+        matches = [match for line_id, line in enumerate(lines, first_id) for match in self.match_line(line_id, line)]
+        self.search_matches[start:] = matches + [(line_id + delta, match_start, match_end)
+                                                 for line_id, match_start, match_end in self.search_matches[end:]]
+        if self.search_current is not None and self.search_current >= start:
+            if self.search_current >= end:
+                self.search_current += len(matches) - (end - start)
+            else:
+                self.search_current = None
+
+    def move_sublines(self, first, removed, added):
+        """
+        Move the display and the selection after removed sublines from first
+        on were replaced by added sublines, and queue a redraw of the
+        displayed rows that changed.
+
+        Selection ends in the removed sublines are moved to first.
+        """
+        delta = added - removed
+        end = first + removed
+
+        def move(pos):
+            if pos is None or pos[0] < first:
+                return pos
+            return (pos[0] + delta, pos[1]) if pos[0] >= end else (first, 0)
+
+        self.selection_start = move(self.selection_start)
+        self.selection_end = move(self.selection_end)
+
+        if self.start_subline >= end:
+            # the displayed sublines did not change, keep them in the frame
+            self.start_subline += delta
+            self.frame_position += delta * self.fontheight
+            self.frame_rows = {subline_no + delta if subline_no >= end else subline_no: key
+                               for subline_no, key in self.frame_rows.items() if not first <= subline_no < end}
+            if delta:
+                self.display_moved()
+            return
+        if self.start_subline > first:
+            self.start_subline = first
+            self.start_offset = 0
+        if delta:
+            self.display_moved()
+        self.frame_rows = {subline_no: key for subline_no, key in self.frame_rows.items() if subline_no < first}
+        last = first + added - 1 if delta == 0 else self.start_subline + int(math.ceil(self.max_lines))
+        self.queue_draw_sublines(first, last)
+
+    def push_line(self, line):
+        """
+        Append a line from any thread.
+
+        See push_lines.
+        """
+        self.push_lines([line])
+
+    def push_lines(self, lines):
+        """
+        Append some lines from any thread.
+
+        The lines are queued and appended in the main loop.  All lines that
+        are pushed until then are wrapped as one batch with a single redraw.
+        """
+        with self.pending_lock:
+            self.pending_lines.extend(lines)
+            if self.pending_source is None:
+                # run before the redraw, which has a lower priority
+                self.pending_source = GLib.idle_add(self.flush_pending_lines, priority=GLib.PRIORITY_HIGH_IDLE)
+
+    def flush_pending_lines(self):
+        """
+        Append the pushed lines.
+
+        This is called in the main loop after lines were pushed.
+        """
+        with self.pending_lock:
+            lines = list(self.pending_lines)
+            self.pending_lines.clear()
+            self.pending_source = None
+        if lines:
+            self.append_lines(lines)
+        for listener in self.pending_listeners:
+            listener()
+        return GLib.SOURCE_REMOVE
+
+    def trim_scrollback(self):
+        """
+        Remove the oldest buffer lines until the buffer fits into the limits
+        given by scrollback_lines and scrollback_bytes.
+        """
+        count = 0
+        if self.scrollback_lines is not None:
+            count = max(0, len(self.buffer) - self.scrollback_lines)
+        if self.scrollback_bytes is not None:
+            size = self.buffer_bytes - sum(len(line.encode()) for line in self.buffer[:count])
+            while count < len(self.buffer) and size > self.scrollback_bytes:
+                size -= len(self.buffer[count].encode())
+                count += 1
+        if count:
+            self.evict_lines(count)
+
+    def evict_lines(self, count):
+        """
+        Remove the oldest count buffer lines together with their  sublines.
+
+        The displayed sublines and the selection are moved accordingly.
+        """
+        for line in self.buffer.popleft(count):
+            self.buffer_bytes -= len(line.encode())
+            self.lines_evicted += 1
+        self.line_links.popleft(count)
+        if self.search_index is not None:
+            self.search_index.evict(count)
+        if self.search_regex is not None:
+            removed = bisect.bisect_left(self.search_matches, (self.lines_evicted,))
+            del self.search_matches[:removed]
+            if self.search_current is not None:
+                self.search_current = self.search_current - removed if self.search_current >= removed else None
+        if self.wrap_width is None:
+            return
+        removed = self.sublines.evict(count)
+
+        # move the display and the last frame, so its rows are reused
+        if self.start_subline >= removed:
+            self.start_subline -= removed
+        else:
+            self.start_subline = self.start_offset = 0
+        self.frame_position -= removed * self.fontheight
+        self.frame_rows = {subline_no - removed: key for subline_no, key in self.frame_rows.items()
+                           if subline_no >= removed}
+        self.display_moved()
+
+        # move the selection, evicted parts are deselected
+        if self.selection_start is not None and self.selection_end is not None:
+            start, end = sorted([self.selection_start, self.selection_end])
+            if end[0] < removed:
+                self.selection_start = self.selection_end = None
+                self.selection_active = False
+            else:
+                self.selection_start, self.selection_end = [
+                    (0, 0) if sl < removed else (sl - removed, si)
+                    for sl, si in (self.selection_start, self.selection_end)
+                ]
+        elif self.selection_start is not None:
+            sl, si = self.selection_start
+            self.selection_start = (0, 0) if sl < removed else (sl - removed, si)
+
+    def sublines_moved(self, subline_no, delta):
+        """
+        Move the display and the selection after lazily wrapped sublines.
+
+        All sublines from subline_no on were moved by delta.
+        """
+        if self.start_subline >= subline_no:
+            self.start_subline += delta
+        if self.selection_start is not None and self.selection_start[0] >= subline_no:
+            self.selection_start = self.selection_start[0] + delta, self.selection_start[1]
+        if self.selection_end is not None and self.selection_end[0] >= subline_no:
+            self.selection_end = self.selection_end[0] + delta, self.selection_end[1]
+
+    def estimate_sublines(self, length, width):
+        """
+        Estimate the number of sublines of a line of length characters that
+        is not wrapped yet.
+        """
+        return max(1, -(-length * self.char_width // max(1, width)))
+
+    def do_draw(self, cr):
+        """
+        Draw the widget graphics.
+        """
+        self.buffer_indent = max(self.buffer_indent, self.margin)
+        start = time.perf_counter() if self.stats is not None else 0
+
+        x1, y1, x2, y2 = cr.clip_extents()
+        frame = self.render_frame(self.get_allocated_width(), self.get_allocated_height(), (y1, y2))
+        cr.set_source_surface(frame, 0, 0)
+        cr.paint()
+
+        if self.stats is not None:
+            self.stats.frame_done(time.perf_counter() - start, self.frame_chars)
+
+    def render_frame(self, width, height, clip=None):
+        """
+        Render the visible sublines into an image surface and return it.
+
+        If the size, the fonts and the colors did not change since the last
+        frame, the last frame is moved by the scroll distance and only  the
+        sublines that are not in it yet or that changed are rendered.
+
+        clip is the (top, bottom) range of y-coordinates that is  redrawn.
+        If the widget was not scrolled, only the sublines in it are checked
+        for changes, the others are taken from the last frame.
+        """
+        scale = self.get_scale_factor()
+        key = (width, height, scale, self.fontheight, self.font_version, self.palette_version,
+               self.get_message_left())
+        position = self.start_subline * self.fontheight + self.start_offset
+        old_position = self.frame_position
+
+        reuse = self.frame is not None and self.frame_key == key
+        if reuse and position == old_position:
+            # draw the changed sublines over the last frame
+            frame, back_frame = self.frame, self.back_frame
+            cr = cairo.Context(frame)
+        else:
+            frame, back_frame = self.back_frame, self.frame
+            if frame is None or (frame.get_width(), frame.get_height()) != (width * scale, height * scale):
+                frame = cairo.ImageSurface(cairo.FORMAT_RGB24, width * scale, height * scale)
+            frame.set_device_scale(scale, scale)
+            cr = cairo.Context(frame)
+            if reuse:
+                # move the last frame
+                with saved(cr):
+                    cr.set_operator(cairo.OPERATOR_SOURCE)
+                    cr.set_source_surface(self.frame, 0, old_position - position)
+                    cr.paint()
+
+        rows = {}
+        chars = 0
+        first_subline = self.start_subline
+        last_subline = self.start_subline + (height + self.start_offset - 1) // self.fontheight
+        if clip is not None and reuse and position == old_position:
+            rows = dict(self.frame_rows)
+            first_subline = max(first_subline, int(clip[0] + position) // self.fontheight)
+            last_subline = min(last_subline, int(math.ceil(clip[1] + position) - 1) // self.fontheight)
+        for subline_no in range(first_subline, last_subline + 1):
+            if subline_no < len(self.sublines):
+                attrs, text = self.sublines[subline_no]
+                row_key = self.get_subline_key(attrs, text, subline_no)
+            else:
+                row_key = None  # empty row
+            rows[subline_no] = row_key
+            top = subline_no * self.fontheight - position
+
+            # skip unchanged sublines that were fully visible in the last frame
+            old_top = subline_no * self.fontheight - old_position
+            if reuse and 0 <= old_top <= height - self.fontheight and self.frame_rows.get(subline_no, 0) == row_key:
+                continue
+
+            if row_key is not None:
+                chars += len(text)
+            if row_key is None:
+                cr.rectangle(0, top, width, self.fontheight)
+                self.set_source_color(cr, "background")
+                cr.fill()
+                if self.indent:
+                    self.draw_sep(cr, self.buffer_indent, top, self.fontheight)
+            elif self.subline_cache_size:
+                cr.set_source_surface(self.get_subline_surface(attrs, text, subline_no, width), 0, top)
+                cr.rectangle(0, top, width, self.fontheight)
+                cr.fill()
+            else:
+                cr.rectangle(0, top, width, self.fontheight)
+                self.set_source_color(cr, "background")
+                cr.fill()
+                self.draw_line(cr, attrs, text, subline_no, top)
+        frame.flush()
+
+        self.frame, self.back_frame = frame, back_frame
+        self.frame_key = key
+        self.frame_position = position
+        self.frame_rows = rows
+        self.frame_chars = chars
+        return frame
+
+    def get_subline_key(self, attrs, text, subline_no):
+        """
+        Return a key that is equal for sublines that are rendered the same.
+        """
+        return (text, Style.from_attrs(attrs), self.get_subline_selection(subline_no),
+                self.get_subline_highlights(subline_no), self.get_subline_hover(subline_no),
+                self.get_nick(subline_no))
+
+    def get_subline_surface(self, attrs, text, subline_no, width):
+        """
+        Return an image surface with the rendered subline.
+
+        The surfaces are kept in an LRU cache of at most subline_cache_size
+        entries and subline_cache_bytes pixel data.  They are keyed by
+        everything that changes the rendering, so only sublines with a new
+        text or a changed selection are rendered again.
+        """
+        key = (self.get_subline_key(attrs, text, subline_no), width, self.get_message_left(),
+               self.get_scale_factor(), self.font_version, self.palette_version)
+        surface = self.subline_cache.get(key)
+        if self.stats is not None:
+            self.stats.add("subline_cache_miss" if surface is None else "subline_cache_hit")
+        if surface is not None:
+            self.subline_cache.move_to_end(key)
+            return surface
+
+        scale = self.get_scale_factor()
+        surface = cairo.ImageSurface(cairo.FORMAT_RGB24, width * scale, self.fontheight * scale)
+        surface.set_device_scale(scale, scale)
+        cr = cairo.Context(surface)
+        self.set_source_color(cr, "background")
+        cr.paint()
+        self.draw_line(cr, attrs, text, subline_no)
+        surface.flush()
+
+        self.subline_cache[key] = surface
+        self.subline_cache_used += surface.get_stride() * surface.get_height()
+        while len(self.subline_cache) > self.subline_cache_size or \
+                (self.subline_cache_used > self.subline_cache_bytes and len(self.subline_cache) > 1):
+            cached = self.subline_cache.popitem(last=False)[1]
+            self.subline_cache_used -= cached.get_stride() * cached.get_height()
+        return surface
+
+    def clear_subline_cache(self):
+        """
+        Drop all rendered sublines, see get_subline_surface.
+        """
+        self.subline_cache.clear()
+        self.subline_cache_used = 0
+
+    def draw_line(self, cr, attrs, text, subline_no, top=0):
+        """
+        Draw a subline with its selection, search matches and hovered link.
+
+        With indent, the nick of the line is drawn in front of its  first
+        subline and all sublines start at the message column.
+        """
+        left = 0
+        if self.indent:
+            nick = self.get_nick(subline_no)
+            if nick:
+                self.draw_nick(cr, nick, top)
+            self.draw_sep(cr, self.buffer_indent, top, self.fontheight)
+            left = self.get_message_left()
+        self.draw_subline(cr, attrs, text, top, self.get_subline_selection(subline_no),
+                          self.get_subline_highlights(subline_no), self.get_subline_hover(subline_no), left)
+
+    def draw_nick(self, cr, nick, top=0):
+        """
+        Draw a nick right-aligned in the nick column.
+
+        Nicks that are wider than the column are cut off at the left.
+        """
+        right = self.buffer_indent - self.margin
+        with saved(cr):
+            cr.rectangle(0, top, max(0, right), self.fontheight)
+            cr.clip()
+            self.draw_subline(cr, {}, nick, top, left=right - self.get_nick_width(nick))
+
+    def get_message_left(self):
+        """
+        Return the x-coordinate of the message column, 0 without indent.
+        """
+        return self.buffer_indent + self.margin if self.indent else 0
+
+    def get_nick(self, subline_no):
+        """
+        Return the nick that is displayed in front of a subline.
+
+        Only the first subline of a line that contains a tab has  a  nick,
+        for the other sublines the nick is empty.
+        """
+        if not self.indent or subline_no >= len(self.sublines):
+            return ""
+        line_no, start, _ = self.sublines.span(subline_no)
+        line = self.buffer[line_no]
+        if start and start == message_start(line):
+            return line[:start - 1]
+        return ""
+
+    def get_nick_width(self, nick):
+        """
+        Return the width of a nick.
+
+        The widths are measured once and cached until the fonts change,  so
+        moving the separator does not measure the nick column again.
+        """
+        width = self.nick_widths.get(nick)
+        if width is None:
+            if len(self.nick_widths) >= self.nick_widths_size:
+                self.nick_widths.clear()
+            width = self.nick_widths[nick] = sum(
+                self.get_width_table(run.style.bold).text_width(nick[run.start:run.end]) for run in tokenize(nick))
+        return width
+
+    def get_subline_selection(self, subline_no):
+        """
+        Return the start and end offset of the selected part of a subline.
+
+        Both offsets are 0 if nothing of the subline is selected.
+        """
+        if self.selection_start is None or self.selection_end is None:
+            return 0, 0
+        (sl, si), (el, ei) = sorted([self.selection_start, self.selection_end])
+        if not sl <= subline_no <= el:
+            return 0, 0
+        start = si if sl == subline_no else 0
+        end = ei if el == subline_no else math.inf
+        return start, max(start, end)
+
+    def get_subline_highlights(self, subline_no):
+        """
+        Return the search matches in a subline as a tuple of (start,  end,
+        current) tuples, where start and end are offsets into  the  subline
+        and current is True for the current match.
+        """
+        if not self.search_matches:
+            return ()
+        line_no, line_start, line_end = self.sublines.span(subline_no)
+        line_id = self.lines_evicted + line_no
+        highlights = []
+        i = bisect.bisect_left(self.search_matches, (line_id,))
+        while i < len(self.search_matches) and self.search_matches[i][0] == line_id:
+            _, start, end = self.search_matches[i]
+            if start < line_end and end > line_start:
+                highlights.append((max(start, line_start) - line_start, min(end, line_end) - line_start,
+                                   i == self.search_current))
+            i += 1
+        return tuple(highlights)
+
+    def get_subline_hover(self, subline_no):
+        """
+        Return the start and end offset of the hovered link in a subline.
+
+        Both offsets are 0 if the link is not in the subline.
+        """
+        if self.hover_link is None:
+            return 0, 0
+        line_no, line_start, line_end = self.sublines.span(subline_no)
+        line_id, start, end = self.hover_link
+        if line_id != self.lines_evicted + line_no or start >= line_end or end <= line_start:
+            return 0, 0
+        return max(start, line_start) - line_start, min(end, line_end) - line_start
+
+    def draw_sep(self, cr, x, top, height):
+        """
+        Draw the part of the separator line in a row.
+        """
+        with saved(cr):
+            self.set_source_color(cr, "thin_sep")
+            cr.set_line_width(1)
+            cr.move_to(x + 0.5, top)
+            cr.line_to(x + 0.5, top + height)
+            cr.stroke()
+
+    def is_on_separator(self, x):
+        """
+        Return True if an x-coordinate is on the separator, so it  can  be
+        dragged.
+        """
+        return self.indent and abs(x - self.buffer_indent) <= self.margin
+
+    def set_separator_hover(self, hover):
+        """
+        Show a resize cursor while the pointer is over the separator.
+        """
+        if hover != self.separator_hover:
+            self.separator_hover = hover
+            self.update_cursor()
+
+    def move_separator(self, x):
+        """
+        Move the separator to an x-coordinate while it is dragged.
+
+        Only the displayed lines are wrapped again for the new width of the
+        message column, so wrap_width keeps the width of the other lines and
+        finish_separator_drag wraps all lines when the drag ends.
+        """
+        width = self.get_allocated_width()
+        indent = max(self.margin, min(int(x), width - self.margin - 10 * self.char_width))
+        if indent == self.buffer_indent:
+            return
+        self.buffer_indent = indent
+        if len(self.sublines):
+            selection = None
+            if self.selection_start is not None and self.selection_end is not None:
+                selection = [self.sublines.to_line_pos(*pos) for pos in (self.selection_start, self.selection_end)]
+
+            self.start_subline = min(self.start_subline, len(self.sublines) - 1)
+            line_no, first = self.sublines.locate(self.start_subline)
+            self.sublines.rewrap_lines(width - self.get_message_left(), line_no,
+                                       self.start_subline - first + int(math.ceil(self.max_lines)) + 1)
+            self.start_subline = min(self.start_subline, first + len(self.sublines.get_packed(line_no)) // 3 - 1)
+
+            if selection is not None:
+                self.selection_start, self.selection_end = self.sublines.from_line_positions(selection)
+            self.wrapped_partly = True
+        self.queue_draw()
+
+    def finish_separator_drag(self):
+        """
+        Wrap all lines for the new separator position after a drag, big
+        buffers in a thread, see size_allocate_cb.
+        """
+        self.separator_drag = False
+        self.size_allocate_cb(self.get_allocation())
+        self.queue_draw()
+
+    def do_button_press_event(self, event):
+        """
+        Start selection or dragging the separator.
+        """
+        if self.is_on_separator(event.x):
+            self.separator_drag = True
+            return
+        self.queue_draw_selection()
+        subline = self.find_char_at_pos(event.x, event.y)
+        if subline is not None:
+            self.selection_active = True
+            self.selection_start = subline[:2]
+            self.selection_end = None
+        else:
+            self.selection_active = False
+            self.selection_start = self.selection_end = None
+
+    def do_button_release_event(self, event):
+        """
+        End selection or dragging the separator.
+        """
+        if self.separator_drag:
+            self.finish_separator_drag()
+        elif self.selection_active:
+            self.selection_active = False
+            subline = self.find_char_at_pos(event.x, event.y)
+            if subline is not None:
+                self.selection_end = subline[:2]
+
+            if subline is None or self.selection_start == self.selection_end:
+                self.selection_start = self.selection_end = None
+                link = self.find_link_at_pos(event.x, event.y)
+                if link is not None and self.link_handler is not None:
+                    self.link_handler(*link)
+            else:
+                self.copy_selection()
+            self.queue_draw()
+
+    def do_motion_notify_event(self, event):
+        """
+        Refresh the selection end, the separator or the hovered link.
+        """
+        if self.separator_drag:
+            self.move_separator(event.x)
+        elif self.selection_active:
+            subline = self.find_char_at_pos(event.x, event.y)
+            if subline is not None:
+                self.set_selection_end(subline[:2])
+        else:
+            on_separator = self.is_on_separator(event.x)
+            self.set_separator_hover(on_separator)
+            self.set_hover_link(None if on_separator else self.find_link_at_pos(event.x, event.y))
+
+    def set_selection_end(self, end):
+        """
+        Move the selection end and redraw only the visible sublines  whose
+        selection changed.
+        """
+        old_end = self.selection_end
+        if end == old_end:
+            return
+        first_row = self.start_subline
+        last_row = self.start_subline + int(math.ceil(self.max_lines))
+        ends = [end[0], (old_end or self.selection_start or end)[0]]
+        first, last = max(first_row, min(ends)), min(last_row, max(ends))
+        old = [self.get_subline_selection(subline_no) for subline_no in range(first, last + 1)]
+        self.selection_end = end
+        changed = [subline_no for subline_no, selection in zip(range(first, last + 1), old)
+                   if self.get_subline_selection(subline_no) != selection]
+        if self.stats is not None:
+            self.stats.add("selection_update")
+            self.stats.add("selection_rows", len(changed))
+
+        # queue the changed rows, adjacent rows as one area
+        for _, group in itertools.groupby(enumerate(changed), lambda item: item[1] - item[0]):
+            group = [subline_no for _, subline_no in group]
+            self.queue_draw_sublines(group[0], group[-1])
+
+    def queue_draw_selection(self):
+        """
+        Queue a redraw of the visible sublines of the selection.
+        """
+        if self.selection_start is None or self.selection_end is None:
+            return
+        first, last = sorted([self.selection_start[0], self.selection_end[0]])
+        first = max(first, self.start_subline)
+        last = min(last, self.start_subline + int(math.ceil(self.max_lines)))
+        if first <= last:
+            self.queue_draw_sublines(first, last)
+
+    def queue_draw_sublines(self, first, last):
+        """
+        Queue a redraw of the rows of the sublines first to last.
+        """
+        position = self.start_subline * self.fontheight + self.start_offset
+        top = max(0, first * self.fontheight - position)
+        bottom = min(self.get_allocated_height(), (last + 1) * self.fontheight - position)
+        if bottom > top:
+            self.queue_draw_area(0, top, self.get_allocated_width(), bottom - top)
+
+    def set_hover_link(self, link):
+        """
+        Underline the hovered link and show a hand cursor over it.
+
+        link is a (line_no, Link) tuple or None.
+        """
+        hover = None
+        if link is not None:
+            line_no, link = link
+            hover = self.lines_evicted + line_no, link.start, link.end
+        if hover == self.hover_link:
+            return
+        self.hover_link = hover
+        self.update_cursor()
+        self.queue_draw()
+
+    def update_cursor(self):
+        """
+        Show a resize cursor over the separator, a hand cursor over a link
+        and the default cursor elsewhere.
+        """
+        window = self.get_window()
+        if window is None:
+            return
+        if self.separator_hover:
+            name = "col-resize"
+        elif self.hover_link is not None:
+            name = "pointer"
+        else:
+            name = None
+        window.set_cursor(None if name is None else Gdk.Cursor.new_from_name(window.get_display(), name))
+
+    def find_link_at_pos(self, x, y):
+        """
+        Find the link at the given x/y-coordinates.
+
+        Returns the buffer line number and the Link, or None if there is no
+        link at the coordinates.  The links of a line are sorted, so they are
+        searched with bisection.
+        """
+        subline = self.find_char_at_pos(x, y)
+        if subline is None or subline[0] >= len(self.sublines) or not subline[2]:
+            return None
+        subline_no, char, _ = subline
+        line_no, line_start, _ = self.sublines.span(subline_no)
+        offset = line_start + char
+        links = self.get_links(line_no)
+        i = bisect.bisect_right(links, (offset, math.inf)) - 1
+        if i >= 0 and offset < links[i].end:
+            return line_no, links[i]
+        return None
+
+    def find_char_at_pos(self, x, y):
+        """
+        Find the subline number, the character  number  and  the  character
+        itself at the given x/y-coordinates.
+
+        If there is no character at the coordinates, the character text  is
+        empty and the number is equal to the subline length.
+        """
+        if self.stats is not None:
+            with self.stats.timed("hit_test"):
+                return self.locate_char(x, y)
+        return self.locate_char(x, y)
+
+    def locate_char(self, x, y):
+        left = self.get_message_left()
+        try:
+            subline_no, text = self.find_subline_at_pos(y)
+        except TypeError:
+            return None
+        if x < left:
+            return subline_no, 0, ""  # in the nick column
+        attrs = self.sublines[subline_no][0] if subline_no < len(self.sublines) else {}
+        for run in tokenize(text, Style.from_attrs(attrs)):
+            char_width = self.get_width_table(run.style.bold).char_width
+            for i in range(run.start, run.end):
+                width = char_width(text[i])
+
+                if left <= x < left + width:
+                    return subline_no, i, text[i]
+
+                left += width
+        return subline_no, len(text), ""
+
+    def find_subline_at_pos(self, y):
+        """
+        Find the subline number and subline text at a given y-coordinate.
+
+        If there is no subline at the y-coordinate,  the  subline  text  is
+        empty.
+        """
+        subline_no = self.start_subline + int((y + self.start_offset) / self.fontheight)
+        if subline_no < len(self.sublines):
+            return subline_no, self.sublines[subline_no][1]
+        return subline_no, ""
+
+    def get_selection(self):
+        """
+        Return the text between selection start and selection end.
+
+        If end is smaller than start, start and end are swapped.  The start
+        is included in the selected text, the end is excluded.
+        """
+        return "".join(self.iter_text(*self.get_selection_range()))
+
+    def get_selection_range(self):
+        """
+        Return the start and the end of the selection as sorted buffer line
+        positions.
+
+        Raises IndexError if the selection starts after the last line.
+        """
+        # convert one after the other, wrapping a line may move the other
+        start = self.sublines.to_line_pos(*self.selection_start)
+        end = self.sublines.to_line_pos(*self.selection_end)
+        start, end = sorted([start, end])
+        if start[0] >= len(self.buffer):
+            raise IndexError("selection out of range")
+        return start, end
+
+    def iter_text(self, start, end):
+        """
+        Yield the text between two buffer line positions without its format
+        codes in pieces.
+
+        The lines are stripped one by one, so the text of the whole range is
+        never copied before it is joined.
+        """
+        (sl, sc), (el, ec) = start, end
+        if sl == el:
+            yield strip_attributes(self.buffer[sl][sc:ec])
+            return
+        yield strip_attributes(self.buffer[sl][sc:])
+        for line_no in range(sl + 1, min(el, len(self.buffer))):
+            yield "\n"
+            yield strip_attributes(self.buffer[line_no])
+        if el < len(self.buffer):
+            yield "\n"
+            yield strip_attributes(self.buffer[el][:ec])
+
+    def copy_selection(self):
+        """
+        Offer the selected text on the clipboard.
+
+        Only the range of the selection is stored, the text is created when
+        another application pastes it, see selection_get_cb.  It is taken
+        from the lines that are in the buffer then.
+        """
+        try:
+            (sl, sc), (el, ec) = self.get_selection_range()
+        except IndexError:
+            return  # don't offer text if lines out of range are selected
+        if Gtk.selection_owner_set(self, Gdk.SELECTION_CLIPBOARD, Gtk.get_current_event_time()):
+            self.clipboard_selection = self.lines_evicted + sl, sc, self.lines_evicted + el, ec
+
+    def get_clipboard_text(self):
+        """
+        Return the text that was copied with copy_selection.
+
+        Lines that were evicted since then are left out.
+        """
+        if self.clipboard_selection is None:
+            return ""
+        start_id, sc, end_id, ec = self.clipboard_selection
+        start = (start_id - self.lines_evicted, sc) if start_id >= self.lines_evicted else (0, 0)
+        if end_id < self.lines_evicted or start[0] >= len(self.buffer):
+            return ""
+        return "".join(self.iter_text(start, (end_id - self.lines_evicted, ec)))
+
+    def selection_get_cb(self, selection_data, info, time):
+        if self.clipboard_selection is not None:
+            selection_data.set_text(self.get_clipboard_text(), -1)
+
+    def selection_clear_cb(self, event):
+        self.clipboard_selection = None  # another application owns the clipboard now
+        return False
+
+    def search(self, pattern, regex=False, case=False):
+        """
+        Search the buffer lines and highlight the matches.
+
+        The lines are searched without their format codes, see strip_attributes.
+        pattern is a text or, if regex is set, a regular expression.  The case
+        is ignored unless case is set.  Lines that are appended later are
+        searched as well.  Returns the matches as SearchMatch tuples, an empty
+        pattern clears the search.
+
+        The first search builds an index of the lines that is updated when
+        lines are appended or evicted, so only lines that contain the  text
+        of the pattern are searched.
+        """
+        if not pattern:
+            self.clear_search()
+            return []
+        self.search_regex = re.compile(pattern if regex else re.escape(pattern), 0 if case else re.IGNORECASE)
+        self.search_literals = regex_literals(pattern) if regex else [pattern]
+        self.update_search()
+        return self.get_search_matches()
+
+    def update_search(self):
+        """
+        Search all buffer lines for the current search pattern again.
+        """
+        if self.search_index is None:
+            self.search_index = SearchIndex(self.lines_evicted)
+            for line in self.buffer:
+                self.search_index.add(strip_attributes(line))
+        line_ids = self.search_index.candidates(self.search_literals)
+        if line_ids is None:
+            line_ids = range(self.search_index.first, self.search_index.next)
+        self.search_matches = []
+        for line_id in line_ids:
+            self.search_matches.extend(self.match_line(line_id, self.buffer[line_id - self.lines_evicted]))
+        self.search_current = None
+        self.queue_draw()
+
+    def match_line(self, line_id, line):
+        """
+        Return the (line id, start, end) tuples of the matches in a line.
+        """
+        text = strip_attributes(line)
+        spans = [match.span() for match in self.search_regex.finditer(text) if match.end() > match.start()]
+        if not spans:
+            return []
+        offsets = visible_offsets(line)
+        return [(line_id, offsets[start], offsets[end - 1] + 1) for start, end in spans]
+
+    def reset_search_index(self):
+        """
+        Drop the search index after the buffer was replaced or changed  and
+        repeat the current search.
+        """
+        self.search_index = None
+        if self.search_regex is not None:
+            self.update_search()
+
+    def clear_search(self):
+        """
+        Remove the search highlights.
+        """
+        self.search_regex = None
+        self.search_literals = []
+        self.search_matches = []
+        self.search_current = None
+        self.queue_draw()
+
+    def get_search_matches(self):
+        """
+        Return the matches of the current search as SearchMatch tuples.
+        """
+        return [SearchMatch(line_id - self.lines_evicted, start, end) for line_id, start, end in self.search_matches]
+
+    def search_next(self):
+        """
+        Make the next search match the current one, scroll to it and return
+        it.  Returns None if there are no matches.
+        """
+        return self.move_search(1)
+
+    def search_previous(self):
+        """
+        Make the previous search match the current one, scroll to  it  and
+        return it.  Returns None if there are no matches.
+        """
+        return self.move_search(-1)
+
+    def move_search(self, step):
+        if not self.search_matches:
+            return None
+        if self.search_current is None:
+            self.search_current = 0 if step > 0 else len(self.search_matches) - 1
+        else:
+            self.search_current = (self.search_current + step) % len(self.search_matches)
+        line_id, start, end = self.search_matches[self.search_current]
+        self.scroll_to_line_pos(line_id - self.lines_evicted, start)
+        self.queue_draw()
+        return SearchMatch(line_id - self.lines_evicted, start, end)
+
+    def scroll_to_line_pos(self, line_no, char):
+        """
+        Scroll a buffer line position into the middle of the widget  unless
+        it is visible already.
+        """
+        subline_no = self.sublines.from_line_pos(line_no, char)[0]
+        if not self.start_subline <= subline_no < self.start_subline + int(self.max_lines):
+            self.scroll_to_subline(max(0, subline_no - int(self.max_lines) // 2))
+
+    def scroll_to_subline(self, subline_no):
+        """
+        Display a subline at the top of the widget.
+
+        If scroll_handler is set, it is called with the subline number  and
+        the pixel offset 0 and scrolls instead, so a container like
+        ScrollableXText can keep its scroll position in sync.
+        """
+        if self.scroll_handler is not None:
+            self.scroll_handler(subline_no, 0)
+        else:
+            self.start_subline = subline_no
+            self.start_offset = 0
+        self.queue_draw()
+
+    def display_moved(self):
+        """
+        Call scroll_handler after lines before the display or the number  of
+        sublines changed, so the scroll position of a container follows.
+        """
+        if self.scroll_handler is not None:
+            self.scroll_handler(self.start_subline, self.start_offset)
+
+    def size_allocate_cb(self, rect):
+        self.max_lines = self.get_allocation().height / self.fontheight
+
+        # the sublines are wrapped to the width of the message column
+        width = rect.width - self.get_message_left()
+        lazy = self.sublines.estimate is not None
+        if width == self.wrap_width and lazy == self.wraps_lazily() and not self.wrapped_partly:
+            self.cancel_rewrap()
+        elif width != self.rewrap_width:
+            if self.wrap_width is not None and not self.wraps_lazily() and \
+               self.background_rewrap_lines is not None and len(self.buffer) > self.background_rewrap_lines:
+                if self.stats is not None:
+                    self.stats.add("background_rewrap")
+                self.start_rewrap(width)
+            elif self.stats is not None:
+                with self.stats.timed("rewrap"):
+                    self.rewrap(width)
+            else:
+                self.rewrap(width)
+
+    def rewrap(self, width, lazy=None):
+        """
+        Break all buffer lines into sublines for the given width and  keep
+        the selected text selected.
+
+        If lazy is True, the lines are only wrapped when they are displayed.
+        By default, this is done if lazy_wrap is set or the buffer is a
+        FileBuffer.
+        """
+        self.cancel_rewrap()
+        if lazy is None:
+            lazy = self.wraps_lazily()
+        if not lazy:
+            sublines = Sublines(self.buffer, width, self.find_breaks)
+            if self.batch_wrap:
+                sublines.extend_wrapped(self.buffer, self.wrap_batches(self.buffer, width, self.get_width_table))
+            else:
+                for line in self.buffer:
+                    sublines.add_line(line)
+        else:
+            sublines = Sublines(self.buffer, width, self.find_breaks, self.estimate_sublines, self.sublines_moved)
+            if isinstance(self.buffer, FileBuffer):
+                lengths = self.buffer.line_lengths()  # without decoding the lines
+            else:
+                lengths = map(len, self.buffer)
+            sublines.extend_estimated(lengths)
+        self.replace_sublines(sublines)
+
+    def replace_sublines(self, sublines):
+        """
+        Display new sublines and keep the selected text selected.
+        """
+        # save selection
+        selection = None
+        if self.selection_start is not None and self.selection_end is not None:
+            selection = [self.sublines.to_line_pos(*pos) for pos in (self.selection_start, self.selection_end)]
+
+        self.sublines = sublines
+        self.wrap_width = sublines.width
+        self.wrapped_partly = False
+
+        # restore selection
+        if selection is not None:
+            self.selection_start, self.selection_end = self.sublines.from_line_positions(selection)
+
+    def wrap_batches(self, lines, width, get_width_table, generation=None):
+        """
+        Wrap lines batch_size at a time with find_breaks_batch and yield the
+        (start, end, style) tuples of each line.
+
+        With indent, only the messages are wrapped like in find_message_breaks.
+        If generation is given, the batches stop when the rewrap is cancelled.
+        """
+        for i in range(0, len(lines), self.batch_size):
+            if generation is not None and generation != self.rewrap_generation:
+                return
+            batch = lines[i:i + self.batch_size]
+            start_time = time.perf_counter()
+            if self.indent:
+                starts = [message_start(line) for line in batch]
+                breaks = find_breaks_batch([line[start:] for line, start in zip(batch, starts)], width,
+                                           get_width_table)
+                breaks = [[(start + subline_start, start + subline_end, style)
+                           for subline_start, subline_end, style in line_breaks]
+                          for start, line_breaks in zip(starts, breaks)]
+            else:
+                breaks = find_breaks_batch(batch, width, get_width_table)
+            if self.stats is not None and generation is None:
+                self.stats.add("break_line", len(batch), time.perf_counter() - start_time)
+            yield from breaks
+
+    def start_rewrap(self, width):
+        """
+        Rewrap all buffer lines for the given width in a thread.
+
+        The current sublines are displayed until the new ones are ready.   A
+        newer rewrap or a change of the whole buffer cancels this one.
+        """
+        self.cancel_rewrap()
+        self.rewrap_width = width
+        self.rewrap_thread = threading.Thread(target=self.run_rewrap, daemon=True,
+                                              args=(self.rewrap_generation, width, list(self.buffer), self.lines_evicted))
+        self.rewrap_thread.start()
+
+    def cancel_rewrap(self):
+        """
+        Cancel a running rewrap thread.
+        """
+        self.rewrap_generation += 1
+        self.rewrap_width = None
+
+    def run_rewrap(self, generation, width, lines, evicted):
+        """
+        Wrap lines in a thread and pass the sublines to finish_rewrap.
+
+        The width tables are completed in the main loop first, the  lines
+        are wrapped with copies of them, so no Pango objects are used here.
+        """
+        chars = set().union(*lines)
+        tables = {}
+        measured = threading.Event()
+
+        def measure():
+            if generation == self.rewrap_generation:
+                for bold in (False, True):
+                    table = self.get_width_table(bold)
+                    for char in chars:
+                        table.char_width(char)
+                    tables[bold] = table.copy()
+            measured.set()
+            return GLib.SOURCE_REMOVE
+
+        GLib.idle_add(measure)
+        while not measured.wait(0.1):
+            if generation != self.rewrap_generation:
+                return
+        if not tables:
+            return
+
+        breaks = find_message_breaks if self.indent else find_breaks
+        sublines = Sublines(lines, width, lambda line, width: breaks(line, width, tables.__getitem__))
+        if self.batch_wrap:
+            sublines.extend_wrapped(lines, self.wrap_batches(lines, width, tables.__getitem__, generation))
+            if generation != self.rewrap_generation:
+                return
+        else:
+            for i, line in enumerate(lines):
+                if i % 1000 == 0 and generation != self.rewrap_generation:
+                    return
+                sublines.add_line(line)
+        GLib.idle_add(self.finish_rewrap, generation, sublines, evicted)
+
+    def finish_rewrap(self, generation, sublines, evicted):
+        """
+        Display the sublines of a rewrap thread if it was not cancelled.
+
+        The lines that were evicted or appended in the meantime are  removed
+        from or added to the sublines first.
+        """
+        if generation != self.rewrap_generation:
+            return GLib.SOURCE_REMOVE
+        self.rewrap_width = None
+
+        count = len(sublines.lines)
+        removed = min(count, self.lines_evicted - evicted)
+        sublines.evict(removed)
+        sublines.buffer = self.buffer
+        sublines.wrap = self.find_breaks
+        sublines.changed = self.sublines_moved
+        for line in self.buffer[max(0, count - (self.lines_evicted - evicted)):]:
+            sublines.add_line(line)
+
+        self.replace_sublines(sublines)
+        self.queue_draw()
+        return GLib.SOURCE_REMOVE
+
+
+class LineSource:
+
+    """
+    Feed the lines of an asyncio stream into an XText.
+
+    source is an asyncio.StreamReader or an async iterable of bytes  or  str
+    chunks.  Bytes are decoded incrementally, so multi-byte characters may be
+    split between chunks.  The text is split into lines at "\\n", a trailing
+    "\\r" is removed.
+
+    The lines of each chunk are pushed as one batch with XText.push_lines, so
+    the asyncio loop may run in the GLib main loop (e.g. with
+    gi.events.GLibEventLoopPolicy) or in another thread.  If more than
+    max_pending lines wait to be appended, reading pauses until the widget
+    has appended them.
+
+    Usage:
+    >>> process = await asyncio.create_subprocess_exec("tail", "-f", path, stdout=asyncio.subprocess.PIPE)
+    >>> await LineSource(xtext, process.stdout).run()
+    """
+
+    def __init__(self, xtext, source, encoding="utf-8", errors="replace", max_pending=10000, chunk_size=65536):
+        self.xtext = xtext
+        self.source = source
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors)
+        self.max_pending = max_pending
+        self.chunk_size = chunk_size
+        self.rest = ""  # the unfinished last line
+
+    async def chunks(self):
+        """
+        Yield the chunks of the source.
+        """
+        if isinstance(self.source, asyncio.StreamReader):
+            while True:
+                chunk = await self.source.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        else:
+            async for chunk in self.source:
+                yield chunk
+
+    def split(self, chunk):
+        """
+        Decode a chunk and return the finished lines.
+        """
+        if isinstance(chunk, bytes):
+            chunk = self.decoder.decode(chunk)
+        lines = (self.rest + chunk).split("\n")
+        self.rest = lines.pop()
+        return [line[:-1] if line.endswith("\r") else line for line in lines]
+
+    def finish(self):
+        """
+        Return the unfinished last line at the end of the source as a list.
+        """
+        lines = self.split(self.decoder.decode(b"", True) + "\n")
+        return [line for line in lines if line]
+
+    async def run(self):
+        """
+        Read the source until it ends and push its lines.
+        """
+        loop = asyncio.get_running_loop()
+        drained = asyncio.Event()
+
+        def listener():
+            loop.call_soon_threadsafe(drained.set)
+
+        self.xtext.pending_listeners.append(listener)
+        try:
+            async for chunk in self.chunks():
+                lines = self.split(chunk)
+                if lines:
+                    drained.clear()
+                    self.xtext.push_lines(lines)
+                    while len(self.xtext.pending_lines) > self.max_pending:
+                        await drained.wait()
+                        drained.clear()
+            lines = self.finish()
+            if lines:
+                self.xtext.push_lines(lines)
+        finally:
+            self.xtext.pending_listeners.remove(listener)
+
+
+class ScrollableXText(Gtk.Box):
+    __gtype_name__ = 'ScrollableXText'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.adjustment = Gtk.Adjustment(value=0.0,
                                          lower=0.0,
                                          upper=1.0,
                                          step_increment=0.05,
@@ -648,16 +3542,27 @@ class ScrollableXText(Gtk.Box):
         self.xtext.add_events(Gdk.EventMask.SCROLL_MASK)
         self.xtext.connect("scroll-event", self.scroll_cb)
         self.xtext.connect("size-allocate", self.size_allocate_cb)
+        self.xtext.scroll_handler = self.scroll_to_subline
 
     def value_changed_cb(self, adjustment):
         numsublines = len(self.xtext.sublines)
         maxlines = self.xtext.max_lines
         if numsublines >= maxlines:
-            x = math.modf(adjustment.get_value() * (numsublines - maxlines))
-            self.xtext.start_subline = int(x[1])
-            self.xtext.start_offset = int(self.xtext.fontheight * x[0])
+            # rounded to pixels, so scroll_to_subline hits the subline exactly
+            position = round(adjustment.get_value() * (numsublines - maxlines) * self.xtext.fontheight)
+            self.xtext.start_subline, self.xtext.start_offset = divmod(position, self.xtext.fontheight)
             self.xtext.queue_draw()
 
+    def scroll_to_subline(self, subline_no, offset=0):
+        """
+        Scroll the adjustment, so a subline is displayed at the top, offset
+        pixels scrolled out.
+        """
+        fontheight = self.xtext.fontheight
+        scrollable = (len(self.xtext.sublines) - self.xtext.max_lines) * fontheight
+        position = subline_no * fontheight + offset
+        self.adjustment.set_value(min(max(position / scrollable, 0), 1) if scrollable > 0 else 0)
+
     def size_allocate_cb(self, widget, allocation):
         self.adjustment.value_changed()
 